@@ -1,15 +1,33 @@
 import streamlit as st
 import pandas as pd
+import io
 import json
-import sqlite3
 import os
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from cached_ops import (
+    cached_decide_new_field, cached_decide_query_type, cached_generate_filter_sql, close_conns, get_conn, normalize_query
+)
 from typing import Dict, Any, List
 
+# pyarrow ships with streamlit; the CSV export just falls back to pandas without it
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
 # Page configuration
 st.set_page_config(
     page_title="Advanced Free Query - Full Agent System",
     page_icon="🤖",
-    layout="wide"
+    layout="wide",
+    initial_sidebar_state="collapsed"
 )
 
 st.title("🤖 Advanced Free Query - Full Multi-Agent System")
@@ -27,33 +45,24 @@ def check_openai_setup():
     except Exception as e:
         return False, f"Error checking secrets: {e}"
 
+@st.cache_resource(show_spinner=False)
+def get_fq():
+    """Import the advanced query system once per process"""
+    import free_query_v3
+    return free_query_v3
+
+@st.cache_resource(ttl=300, show_spinner=False)
 def test_openai_connection():
-    """Test if OpenAI can be imported and initialized"""
+    """Test if OpenAI can be imported and initialized (cached for 5 minutes)"""
     try:
         # Try to import and test the advanced query system
-        from free_query_v3 import construct_db_from_ledgar, load_records, infer_schema_from_records
+        get_fq()
         return True, "Advanced query system successfully initialized"
     except Exception as e:
         return False, f"Error initializing advanced system: {str(e)}"
 
 # Main app logic
 def main():
-    # Sidebar for system controls
-    with st.sidebar:
-        st.header("🎛️ System Controls")
-        
-        # Database management
-        st.subheader("📊 Database Management")
-        
-        if st.button("🔄 Rebuild Database from LEDGAR", help="Construct fresh database from LEDGAR corpus"):
-            rebuild_database()
-        
-        if st.button("🧪 Run System Tests", help="Execute comprehensive test suite"):
-            run_system_tests()
-            
-        # Show current database status
-        show_database_status()
-    
     # Check OpenAI setup
     openai_configured, config_status = check_openai_setup()
     
@@ -94,315 +103,403 @@ def main():
     # If everything works, show the advanced app
     st.success("✅ Advanced multi-agent system loaded successfully!")
     
-    # Import advanced query system
+    # Import advanced query system (the import itself is the only guarded step)
     try:
-        from free_query_v3 import (
-            handle_query, load_records, infer_schema_from_records,
-            construct_db_from_ledgar, TABLE_NAME, SQL_DB_PATH
-        )
-        
-        # Initialize or load database
-        base_fields, schema = initialize_database()
+        fq = get_fq()
+    except ImportError as e:
+        st.error(f"Error importing advanced system: {e}")
+        st.info("Please ensure all advanced modules are available.")
+        return
+    
+    # Sidebar for system controls; it needs the agent module, so it is only
+    # built once the OpenAI checks above have passed
+    with st.sidebar:
+        st.header("🎛️ System Controls")
         
-        # Main query interface
-        st.markdown("### 🧠 Advanced Query Processing")
-        st.markdown("*Powered by multi-agent system with dynamic field discovery*")
+        # Database management
+        st.subheader("📊 Database Management")
         
-        # Show current capabilities
-        with st.expander("🎯 Current System Capabilities"):
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.markdown("**🔍 Known Fields:**")
-                for field in base_fields:
-                    st.markdown(f"• `{field}`")
-            
-            with col2:
-                st.markdown("**🤖 Active Agents:**")
-                agents = [
-                    "Query Decision Agent",
-                    "Field Extraction Agent", 
-                    "SQL Generation Agent",
-                    "New Field Discovery Agent",
-                    "Parent Field Hierarchy Agent",
-                    "Table Merge Agent"
-                ]
-                for agent in agents:
-                    st.markdown(f"• {agent}")
+        if st.button("🔄 Rebuild Database from LEDGAR", help="Construct fresh database from LEDGAR corpus"):
+            rebuild_database()
         
-        # Example queries based on current capabilities
-        with st.expander("💡 Intelligent Query Examples"):
-            st.markdown("""
-            **Hit Queries (use existing fields):**
-            - "Show me all clauses with companies"
-            - "Find clauses mentioning specific companies"
+        if st.button("🧪 Run System Tests", help="Execute comprehensive test suite"):
+            run_system_tests()
             
-            **Miss Queries (will discover new fields):**
-            - "What are the termination fees?" *(will extract 'termination fee' field)*
-            - "Show me effective dates" *(will extract 'effective date' field)*  
-            - "Find clauses with payment amounts" *(will extract 'amount' field)*
-            - "What about liability limits?" *(will extract 'liability limit' field)*
-            """)
-        
-        # Query input with advanced features
-        st.markdown("#### 🎯 Enter Your Query:")
-        user_query = st.text_input(
-            "Query:",
-            placeholder="e.g., What are the termination fees? (will auto-discover new fields)",
-            help="The system will automatically determine if your query needs new field extraction"
+        # Show current database status
+        show_database_status()
+    
+    # Initialize or load database
+    base_fields, schema = initialize_database()
+    
+    # The session keeps its own copy of the schema and extends it in place
+    # after a miss, so later reruns never have to re-read table metadata
+    st.session_state.setdefault("schema", schema)
+    schema = st.session_state["schema"]
+    base_fields = [col for col in schema if col != "clause"]
+    
+    # Main query interface
+    st.markdown("### 🧠 Advanced Query Processing")
+    st.markdown("*Powered by multi-agent system with dynamic field discovery*")
+    
+    # Show current capabilities
+    with st.expander("🎯 Current System Capabilities"):
+        agents = [
+            "Query Decision Agent",
+            "Field Extraction Agent", 
+            "SQL Generation Agent",
+            "New Field Discovery Agent",
+            "Parent Field Hierarchy Agent",
+            "Table Merge Agent"
+        ]
+        st.markdown(
+            "**🔍 Known Fields:**\n" + "\n".join(f"- `{field}`" for field in base_fields)
+            + "\n\n**🤖 Active Agents:**\n" + "\n".join(f"- {agent}" for agent in agents)
         )
+    
+    # Example queries based on current capabilities
+    with st.expander("💡 Intelligent Query Examples"):
+        st.markdown("""
+        **Hit Queries (use existing fields):**
+        - "Show me all clauses with companies"
+        - "Find clauses mentioning specific companies"
         
-        col1, col2, col3 = st.columns([1, 1, 3])
-        with col1:
-            process_button = st.button("🚀 Process Query", type="primary")
-        with col2:
-            query_type = st.empty()  # Will show hit/miss classification
-        
-        if process_button and user_query:
-            with st.spinner("🤖 Multi-agent system processing..."):
-                try:
-                    # Create containers for real-time updates
-                    st.markdown("#### 🔍 Agent Processing Steps:")
-                    
-                    # Step 1: Query Classification
-                    with st.container():
-                        st.markdown("##### 🎯 Step 1: Query Decision Agent")
-                        classification_col1, classification_col2 = st.columns([1, 2])
-                        
-                        with classification_col1:
-                            with st.spinner("Analyzing query..."):
-                                from free_query_v3 import decide_query_type
-                                classification = decide_query_type(user_query, base_fields)
-                        
-                        with classification_col2:
-                            if classification == "hit":
-                                st.success("🎯 **HIT** - Using existing fields")
-                                st.info(f"Query can be answered with current fields: `{', '.join(base_fields)}`")
-                            else:
-                                st.info("🔍 **MISS** - Will discover new fields")
-                                st.warning("Query requires extraction of new fields from legal documents")
-                    
-                    # Step 2: Field Analysis
-                    st.markdown("##### 🧠 Step 2: Field Analysis")
-                    field_analysis_container = st.container()
-                    
-                    # Initialize variables to avoid scoping issues
-                    new_field = None
-                    parent_field = None
-                    
-                    with field_analysis_container:
-                        if classification == "miss":
-                            field_col1, field_col2 = st.columns([1, 1])
-                            
-                            with field_col1:
-                                st.markdown("**🔍 New Field Discovery Agent:**")
-                                with st.spinner("Identifying new field..."):
-                                    from free_query_v3 import decide_new_field
-                                    new_field, parent_field = decide_new_field(user_query, base_fields)
-                                
-                                st.success(f"**New Field:** `{new_field}`")
-                                if parent_field:
-                                    st.info(f"**Parent Field:** `{parent_field}` (will optimize processing)")
-                                else:
-                                    st.info("**Parent Field:** None (will process all clauses)")
-                            
-                            with field_col2:
-                                st.markdown("**📊 Processing Strategy:**")
-                                if parent_field and parent_field in schema:
-                                    # Count clauses with parent field
-                                    conn = sqlite3.connect(SQL_DB_PATH)
-                                    cur = conn.cursor()
-                                    sanitized_parent = new_field.replace(' ', '_').lower()  # Simple sanitization for display
-                                    try:
-                                        cur.execute(f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE "{parent_field}" IS NOT NULL')
-                                        parent_count = cur.fetchone()[0]
-                                        st.metric("Clauses to Process", f"{parent_count} (optimized)", delta=f"-{50-parent_count} saved")
-                                    except:
-                                        st.metric("Clauses to Process", "50 (all clauses)")
-                                    conn.close()
-                                else:
-                                    st.metric("Clauses to Process", "50 (all clauses)")
-                        else:
-                            st.success("Using existing schema - no new field extraction needed")
-                            st.info(f"Will query existing fields: `{', '.join([f for f in base_fields if f.lower() in user_query.lower()][:3])}`")
-                    
-                    # Step 3: Processing Status
-                    st.markdown("##### ⚡ Step 3: Processing Execution")
-                    processing_container = st.container()
-                    
-                    with processing_container:
-                        # Create columns for different agent activities
-                        if classification == "miss":
-                            agent_col1, agent_col2, agent_col3 = st.columns([1, 1, 1])
-                            
-                            with agent_col1:
-                                st.markdown("**🔧 Field Extraction Agent:**")
-                                extraction_status = st.empty()
-                                extraction_status.info("🔄 Extracting fields from clauses...")
-                            
-                            with agent_col2:
-                                st.markdown("**🔗 Table Merge Agent:**")
-                                merge_status = st.empty()
-                                merge_status.info("⏳ Waiting for extraction...")
-                            
-                            with agent_col3:
-                                st.markdown("**🗄️ SQL Generation Agent:**")
-                                sql_status = st.empty()
-                                sql_status.info("⏳ Waiting for merge...")
-                        else:
-                            st.markdown("**🗄️ SQL Generation Agent:**")
-                            sql_status = st.empty()
-                            sql_status.info("🔄 Generating SQL query...")
-                    
-                    # Step 4: Execute Processing with Live Updates
-                    st.markdown("##### 📊 Step 4: Query Execution")
-                    
-                    # Capture processing output
-                    import io
-                    from contextlib import redirect_stdout
-                    
-                    output_buffer = io.StringIO()
-                    
-                    # Update status during processing
-                    if classification == "miss":
-                        extraction_status.warning("🔄 Extracting new field using LLM...")
-                        
-                    # Execute the query processing
-                    with redirect_stdout(output_buffer):
-                        handle_query(user_query, base_fields, schema)
-                    
-                    # Update final status
-                    if classification == "miss":
-                        extraction_status.success("✅ Field extraction completed")
-                        merge_status.success("✅ Database updated with new field")
-                        sql_status.success("✅ SQL query generated and executed")
+        **Miss Queries (will discover new fields):**
+        - "What are the termination fees?" *(will extract 'termination fee' field)*
+        - "Show me effective dates" *(will extract 'effective date' field)*  
+        - "Find clauses with payment amounts" *(will extract 'amount' field)*
+        - "What about liability limits?" *(will extract 'liability limit' field)*
+        """)
+    
+    query_panel(fq)
+
+
+@st.fragment
+def query_panel(fq):
+    """Query input, agent steps and results; submitting reruns only this panel"""
+    # Read the schema on every panel run so a miss handled here is visible to the next query
+    schema = st.session_state["schema"]
+    base_fields = [col for col in schema if col != "clause"]
+    
+    # Query input with advanced features
+    st.markdown("#### 🎯 Enter Your Query:")
+    user_query = st.text_input(
+        "Query:",
+        placeholder="e.g., What are the termination fees? (will auto-discover new fields)",
+        help="The system will automatically determine if your query needs new field extraction"
+    )
+    
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        process_button = st.button("🚀 Process Query", type="primary")
+    with col2:
+        query_type = st.empty()  # Will show hit/miss classification
+    with col3:
+        show_clause = st.checkbox("Show clause text", help="Include the full clause text in the results preview")
+    
+    if process_button and user_query:
+        with st.spinner("🤖 Multi-agent system processing..."):
+            try:
+                st.markdown("#### 🔍 Agent Processing Steps:")
+                
+                # Every step reports into one placeholder that is re-rendered in place
+                status = st.empty()
+                state = {
+                    "base_fields": base_fields,
+                    "relevant_fields": [f for f in base_fields if f.lower() in user_query.lower()][:3],
+                }
+                status.markdown(_render_steps(state))
+                
+                # Step 1: Query Classification
+                if not base_fields:
+                    classification = "miss"
+                else:
+                    classification = cached_decide_query_type(normalize_query(user_query), tuple(sorted(base_fields)))
+                state["classification"] = classification
+                status.markdown(_render_steps(state))
+                
+                # Step 2: Field Analysis
+                # Initialize variables to avoid scoping issues
+                new_field = None
+                parent_field = None
+                
+                if classification == "miss":
+                    new_field, parent_field = cached_decide_new_field(normalize_query(user_query), tuple(sorted(base_fields)))
+                    state["new_column"] = fq.sanitize_field_name(new_field)
+                    state["clauses_to_process"] = "50 (all clauses)"
+                    if parent_field and parent_field in schema:
+                        # Count clauses with parent field
+                        try:
+                            parent_count = _count_not_null(
+                                fq.SQL_DB_PATH, fq.TABLE_NAME, parent_field, db_mtime()
+                            )
+                            state["clauses_to_process"] = f"{parent_count} (optimized, {50-parent_count} saved)"
+                        except:
+                            pass
+                    state["new_field"] = new_field
+                    state["parent_field"] = parent_field
+                    state["execution"] = "🔄 Extracting new field using LLM, then merging and generating SQL..."
+                else:
+                    state["execution"] = "🔄 Generating SQL query..."
+                status.markdown(_render_steps(state))
+                
+                # Steps 3-4: Execute the query processing on a worker thread, streaming
+                # its log as it is printed and keeping the elapsed time on the status line
+                log_queue = queue.Queue()
+                # Hand over what was already decided so handle_query doesn't ask the agents again
+                where_clause = None
+                if classification == "hit":
+                    where_clause = cached_generate_filter_sql(
+                        normalize_query(user_query), tuple(schema.items()), fq.TABLE_NAME
+                    )
+                future = get_pool().submit(
+                    _run_captured, get_stdout_proxy(), fq.handle_query, log_queue, user_query, base_fields, schema,
+                    classification, where_clause
+                )
+                running = state["execution"]
+                started = time.time()
+                
+                def show_elapsed():
+                    state["execution"] = f"{running} ({time.time() - started:.0f}s)"
+                    status.markdown(_render_steps(state))
+                
+                with st.expander("🔍 Detailed Processing Log", expanded=True):
+                    st.write_stream(_stream_log(log_queue, show_elapsed))
+                result = future.result()
+                invalidate_db_state()
+                
+                # A miss adds a column; make the next full rerun pick up the new schema
+                if classification == "miss":
+                    initialize_database.clear()
+                    state["execution"] = "✅ Field extraction completed · ✅ Database updated with new field · ✅ SQL query generated and executed"
+                else:
+                    state["execution"] = "✅ SQL query executed successfully"
+                
+                # Show updated schema if new field was added
+                result_columns = list(schema)
+                if classification == "miss":
+                    # handle_query reports the schema it ended with; only fall back to
+                    # reading the table when it returns nothing
+                    if result:
+                        updated_schema = result["schema"]
                     else:
-                        sql_status.success("✅ SQL query executed successfully")
-                    
-                    # Step 5: Results Display
-                    st.markdown("##### 📈 Step 5: Results & Analysis")
-                    
-                    # Show processing log
-                    processing_log = output_buffer.getvalue()
-                    if processing_log:
-                        with st.expander("🔍 Detailed Processing Log", expanded=False):
-                            st.code(processing_log, language="text")
+                        cur = get_conn(fq.SQL_DB_PATH).cursor()
+                        cur.execute(f'PRAGMA table_info("{fq.TABLE_NAME}")')
+                        updated_schema = {**schema, **{col[1]: col[2] for col in cur.fetchall() if col[1] not in schema}}
+                    st.session_state["schema"] = updated_schema
+                    result_columns = list(updated_schema)
                     
-                    # Show updated schema if new field was added
-                    if classification == "miss":
-                        st.markdown("**📊 Database Schema Updated:**")
-                        # Reload schema to show new field
-                        conn = sqlite3.connect(SQL_DB_PATH)
-                        cur = conn.cursor()
-                        cur.execute(f'PRAGMA table_info("{TABLE_NAME}")')
-                        updated_schema = {col[1]: col[2] for col in cur.fetchall()}
-                        conn.close()
-                        
-                        schema_col1, schema_col2 = st.columns([1, 1])
-                        with schema_col1:
-                            st.markdown("**Before:**")
-                            st.code(f"Fields: {list(schema.keys())}", language="python")
-                        with schema_col2:
-                            st.markdown("**After:**")
-                            new_fields = [f for f in updated_schema.keys() if f not in schema]
-                            st.code(f"Fields: {list(updated_schema.keys())}", language="python")
-                            if new_fields:
-                                st.success(f"✅ Added: {new_fields}")
+                    state["schema_before"] = list(schema.keys())
+                    state["schema_after"] = list(updated_schema.keys())
+                    state["added"] = result["new_fields"] if result else [f for f in updated_schema.keys() if f not in schema]
+                status.markdown(_render_steps(state))
+                
+                # Step 5: Results Display
+                st.markdown("##### 📈 Step 5: Results & Analysis")
+                
+                # Display query results; handle_query already holds the rows it selected
+                if result and result.get("rows") is not None:
+                    df = pd.DataFrame.from_records(result["rows"], columns=result["columns"])
+                    if not show_clause and "clause" in df.columns:
+                        df["clause_preview"] = df.pop("clause").str.slice(0, CLAUSE_PREVIEW_CHARS)
+                    render_results(df)
+                elif db_exists():
+                    # Show sample results; the full clause text is only loaded on request
+                    df = _fetch_preview(
+                        fq.SQL_DB_PATH, fq.TABLE_NAME, tuple(result_columns),
+                        None if show_clause else CLAUSE_PREVIEW_CHARS, db_mtime()
+                    )
                     
-                    # Display query results
-                    if os.path.exists(SQL_DB_PATH):
-                        conn = sqlite3.connect(SQL_DB_PATH)
-                        
-                        # Show sample results
-                        df = pd.read_sql_query(f"SELECT * FROM {TABLE_NAME} LIMIT 10", conn)
-                        conn.close()
-                        
-                        if not df.empty:
-                            st.markdown("**📋 Query Results:**")
-                            
-                            # Show results summary
-                            result_col1, result_col2, result_col3 = st.columns([1, 1, 1])
-                            with result_col1:
-                                st.metric("Total Results", len(df))
-                            with result_col2:
-                                st.metric("Fields Returned", len(df.columns))
-                            with result_col3:
-                                non_null_cols = sum(1 for col in df.columns if df[col].notna().any())
-                                st.metric("Fields with Data", non_null_cols)
-                            
-                            # Display the data
-                            st.dataframe(df, use_container_width=True)
-                            
-                            # Download option
-                            csv = df.to_csv(index=False)
-                            st.download_button(
-                                label="📥 Download Results as CSV",
-                                data=csv,
-                                file_name=f"query_results_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                                mime="text/csv"
-                            )
-                            
-                            # Show sample data insights
-                            with st.expander("📊 Data Insights", expanded=False):
-                                for col in df.columns:
-                                    if col != 'clause' and df[col].notna().any():
-                                        non_null_count = df[col].notna().sum()
-                                        st.write(f"**{col}:** {non_null_count}/{len(df)} entries have data")
-                        else:
-                            st.info("No results found for your query.")
+                    render_results(df)
+                
+                # Step 6: Next Steps Suggestions
+                st.markdown("##### 🚀 Step 6: What's Next?")
+                
+                if classification == "miss":
+                    st.success("🎉 **New field successfully added to your database!**")
+                    st.info("💡 **Try related queries:** This new field can now be used in future queries for instant results.")
                     
-                    # Step 6: Next Steps Suggestions
-                    st.markdown("##### 🚀 Step 6: What's Next?")
+                    # Suggest related queries
+                    suggestions = [
+                        f"Show me {new_field} greater than [value]",
+                        f"Find clauses with specific {new_field}",
+                        f"Compare {new_field} across different companies"
+                    ]
+                    st.markdown("**🔍 Suggested follow-up queries:**\n" + "\n".join(f"- `{suggestion}`" for suggestion in suggestions))
+                else:
+                    st.success("🎯 **Query executed using existing data!**")
+                    st.info("💡 **Try exploring:** Ask about new fields to expand your database capabilities.")
                     
-                    if classification == "miss":
-                        st.success("🎉 **New field successfully added to your database!**")
-                        st.info("💡 **Try related queries:** This new field can now be used in future queries for instant results.")
-                        
-                        # Suggest related queries
-                        suggestions = [
-                            f"Show me {new_field} greater than [value]",
-                            f"Find clauses with specific {new_field}",
-                            f"Compare {new_field} across different companies"
-                        ]
-                        st.markdown("**🔍 Suggested follow-up queries:**")
-                        for suggestion in suggestions:
-                            st.markdown(f"• `{suggestion}`")
-                    else:
-                        st.success("🎯 **Query executed using existing data!**")
-                        st.info("💡 **Try exploring:** Ask about new fields to expand your database capabilities.")
-                        
-                except Exception as e:
-                    st.error(f"❌ Error in advanced processing: {str(e)}")
-                    with st.expander("🔍 Error Details"):
-                        st.code(str(e))
-                        import traceback
-                        st.code(traceback.format_exc())
-        
-        elif process_button and not user_query:
-            st.warning("Please enter a query.")
+            except Exception as e:
+                st.error(f"❌ Error in advanced processing: {str(e)}")
+                with st.expander("🔍 Error Details"):
+                    st.code(str(e))
+                    st.code(traceback.format_exc())
     
-    except ImportError as e:
-        st.error(f"Error importing advanced system: {e}")
-        st.info("Please ensure all advanced modules are available.")
+    elif process_button and not user_query:
+        st.warning("Please enter a query.")
+
+
+@st.cache_resource
+def get_pool():
+    """Worker threads for long-running query processing, shared across sessions"""
+    return ThreadPoolExecutor(max_workers=4)
 
+class ThreadStdout(io.TextIOBase):
+    """
+    sys.stdout stand-in that sends each thread's writes to the sink that thread
+    registered, and everything else to the original stdout. Pool threads of
+    different sessions can then capture their own prints concurrently, which
+    swapping the process-wide sys.stdout (redirect_stdout) cannot do.
+    """
+    
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+    
+    def writable(self):
+        return True
+    
+    def set_sink(self, sink):
+        """Route the calling thread's writes to sink (None: back to the original stdout)"""
+        self._local.sink = sink
+    
+    def _target(self):
+        return getattr(self._local, "sink", None) or self.default
+    
+    def write(self, s):
+        return self._target().write(s)
+    
+    def flush(self):
+        self._target().flush()
+
+@st.cache_resource
+def get_stdout_proxy():
+    """Install the ThreadStdout proxy as sys.stdout, once per process"""
+    proxy = ThreadStdout(sys.stdout)
+    sys.stdout = proxy
+    return proxy
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _to_csv(df_key, _df):
+    """CSV bytes for a result frame, computed once per distinct df_key"""
+    if pa is not None:
+        # Arrow writes straight from its columnar buffers instead of
+        # converting every cell to a Python str first
+        try:
+            sink = pa.BufferOutputStream()
+            pa_csv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), sink)
+            return sink.getvalue().to_pybytes()
+        except pa.ArrowException:
+            pass  # e.g. a column mixing numbers and text; pandas copes with those
+    return _df.to_csv(index=False).encode("utf-8")
+
+class QueueWriter(io.TextIOBase):
+    """Write-only text sink that forwards each complete line to a queue"""
+    
+    def __init__(self, log_queue):
+        self.log_queue = log_queue
+        self._partial = ""
+    
+    def writable(self):
+        return True
+    
+    def write(self, s):
+        lines = (self._partial + s).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.log_queue.put(line + "\n")
+        return len(s)
+    
+    def end(self):
+        """Flush any unterminated line and post the end-of-log marker (None)"""
+        if self._partial:
+            self.log_queue.put(self._partial + "\n")
+            self._partial = ""
+        self.log_queue.put(None)
+
+def _run_captured(stdout_proxy, fn, log_queue, *args):
+    """Run fn(*args) with this thread's stdout forwarded line by line to log_queue"""
+    writer = QueueWriter(log_queue)
+    stdout_proxy.set_sink(writer)
+    try:
+        return fn(*args)
+    finally:
+        stdout_proxy.set_sink(None)
+        writer.end()
+
+def _stream_log(log_queue, on_idle=None):
+    """Yield the captured lines as a code block until the end marker; on_idle runs while waiting"""
+    yield "```text\n"
+    while True:
+        try:
+            line = log_queue.get(timeout=0.5)
+        except queue.Empty:
+            if on_idle:
+                on_idle()
+            continue
+        if line is None:
+            break
+        yield line
+    yield "```"
+
+def _render_steps(state):
+    """Markdown for the agent processing steps, rebuilt from the current state"""
+    lines = ["##### 🎯 Step 1: Query Decision Agent"]
+    classification = state.get("classification")
+    if classification is None:
+        lines.append("🔄 Analyzing query...")
+        return "\n\n".join(lines)
+    if classification == "hit":
+        lines.append(f"🎯 **HIT** - Query can be answered with current fields: `{', '.join(state['base_fields'])}`")
+    else:
+        lines.append("🔍 **MISS** - Query requires extraction of new fields from legal documents")
+    
+    lines.append("##### 🧠 Step 2: Field Analysis")
+    if classification == "hit":
+        lines.append(f"Using existing schema - will query existing fields: `{', '.join(state['relevant_fields'])}`")
+    elif state.get("new_field") is None:
+        lines.append("🔄 Identifying new field...")
+    else:
+        parent_field = state.get("parent_field")
+        lines.append(f"- **New Field:** `{state['new_field']}` (column `{state['new_column']}`)")
+        if parent_field:
+            lines.append(f"- **Parent Field:** `{parent_field}` (will optimize processing)")
+        else:
+            lines.append("- **Parent Field:** None (will process all clauses)")
+        lines.append(f"- **Clauses to Process:** {state['clauses_to_process']}")
+    
+    if state.get("execution"):
+        lines.append("##### ⚡ Step 3: Processing Execution")
+        lines.append(state["execution"])
+    
+    if state.get("schema_after"):
+        lines.append("**📊 Database Schema Updated:**")
+        lines.append(f"- **Before:** `{state['schema_before']}`")
+        lines.append(f"- **After:** `{state['schema_after']}`")
+        if state.get("added"):
+            lines.append(f"✅ Added: `{state['added']}`")
+    return "\n\n".join(lines)
+
+@st.cache_resource(show_spinner=False)
 def initialize_database():
-    """Initialize or load the database with advanced system"""
+    """Initialize or load the database with advanced system (cached per process; see .clear() callers)"""
     try:
-        from free_query_v3 import (
-            construct_db_from_ledgar, load_records, infer_schema_from_records,
-            TABLE_NAME, SQL_DB_PATH
-        )
+        fq = get_fq()
         
-        if not os.path.exists(SQL_DB_PATH):
+        if not db_exists():
             st.info("🔄 Initializing database with LEDGAR data...")
             with st.spinner("Building database from LEDGAR corpus..."):
-                base_fields, schema = construct_db_from_ledgar()
+                base_fields, schema = fq.construct_db_from_ledgar()
             st.success("✅ Database initialized successfully!")
         else:
-            # Load existing database
-            recs = load_records(SQL_DB_PATH, TABLE_NAME)
-            schema = infer_schema_from_records(recs)
+            # Load existing database: column names/types come straight from
+            # SQLite metadata instead of scanning every row and re-inferring
+            rows = get_conn(fq.SQL_DB_PATH).execute(f'PRAGMA table_info("{fq.TABLE_NAME}")').fetchall()
+            schema = {row[1]: (row[2] or "TEXT") for row in rows}
             base_fields = [col for col in schema if col != "clause"]
+            # Databases built before field indexing / full-text search existed get them on first load
+            fq.create_field_indexes(fq.SQL_DB_PATH, fq.TABLE_NAME, base_fields)
+            fq.create_clause_fts(fq.SQL_DB_PATH, fq.TABLE_NAME)
         
         return base_fields, schema
         
@@ -410,32 +507,150 @@ def initialize_database():
         st.error(f"Error initializing database: {e}")
         return [], {}
 
+def _db_mtime(db_path):
+    """Last modification time of the database, including its WAL file"""
+    wal_path = f"{db_path}-wal"
+    mtime = os.path.getmtime(db_path)
+    if os.path.exists(wal_path):
+        mtime = max(mtime, os.path.getmtime(wal_path))
+    return mtime
+
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_COUNT_SQL: Dict[tuple, str] = {}
+
+def _count_not_null_sql(table_name, col):
+    """Validated, memoized COUNT statement so SQLite sees identical text for each column"""
+    key = (table_name, col)
+    if key not in _COUNT_SQL:
+        if not (_IDENT.match(table_name) and _IDENT.match(col)):
+            raise ValueError(f"Unsafe SQL identifier: {table_name}.{col}")
+        _COUNT_SQL[key] = f'SELECT COUNT(*) FROM "{table_name}" WHERE "{col}" IS NOT NULL'
+    return _COUNT_SQL[key]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _count_not_null(db_path, table_name, col, mtime):
+    """Number of rows where col is set; mtime is only the cache key"""
+    return get_conn(db_path).execute(_count_not_null_sql(table_name, col)).fetchone()[0]
+
+@st.cache_data(ttl=1, show_spinner=False)
+def _db_stat(db_path):
+    """(exists, mtime) for the database; one stat per second serves every check in a rerun"""
+    if not os.path.exists(db_path):
+        return False, None
+    return True, _db_mtime(db_path)
+
+def db_mtime():
+    """Database mtime, or None when the file is missing"""
+    return _db_stat(get_fq().SQL_DB_PATH)[1]
+
+def db_exists():
+    """Whether the database file exists"""
+    return _db_stat(get_fq().SQL_DB_PATH)[0]
+
+def invalidate_db_state():
+    """Drop the cached stat after we change the database, so the next check sees it immediately"""
+    _db_stat.clear()
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_db_status(db_path, table_name, mtime):
+    """Row count and column names; mtime is only the cache key"""
+    cur = get_conn(db_path).cursor()
+    
+    # Get table info. Rows are only ever bulk-inserted into a freshly created
+    # table and never deleted, so rowids are dense and the largest one is the
+    # row count: a single b-tree descent instead of a COUNT(*) scan.
+    cur.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table_name}"')
+    row_count = cur.fetchone()[0]
+    
+    # Columns only change with DDL; key them by the schema cookie rather than mtime
+    schema_version = cur.execute("PRAGMA schema_version").fetchone()[0]
+    columns = _fetch_columns(db_path, table_name, schema_version)
+    
+    return row_count, columns
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _fetch_columns(db_path, table_name, schema_version):
+    """Column names of the table; schema_version is only the cache key (cleared when the file is recreated)"""
+    rows = get_conn(db_path).execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    return [col[1] for col in rows]
+
+CLAUSE_PREVIEW_CHARS = 200
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_preview(db_path, table_name, columns, clause_chars, mtime):
+    """First rows of the given columns, clause cut to clause_chars unless None; mtime is only the cache key"""
+    select = [f'"{c}"' for c in columns if c != "clause"]
+    if "clause" in columns:
+        select.append('"clause"' if clause_chars is None else f'substr("clause", 1, {int(clause_chars)}) AS clause_preview')
+    select_list = ", ".join(select)
+    return pd.read_sql_query(
+        f"SELECT {select_list} FROM {table_name} LIMIT 10",
+        get_conn(db_path),
+        dtype_backend="pyarrow"
+    )
+
+@st.fragment
+def render_results(df: pd.DataFrame):
+    """Results table, metrics and download; reruns on its own widgets stay local to it"""
+    if not df.empty:
+        st.markdown("**📋 Query Results:**")
+    
+        # One vectorized null mask feeds both the metric and the insights
+        non_null_counts = df.drop(columns=["clause", "clause_preview"], errors="ignore").notna().sum()
+        non_null_cols = int((non_null_counts > 0).sum())
+    
+        # Show results summary
+        result_col1, result_col2, result_col3 = st.columns([1, 1, 1])
+        with result_col1:
+            st.metric("Total Results", len(df))
+        with result_col2:
+            st.metric("Fields Returned", len(df.columns))
+        with result_col3:
+            st.metric("Fields with Data", non_null_cols)
+    
+        # Display the data
+        st.dataframe(df, use_container_width=True)
+    
+        # Download option; the CSV is only serialized once asked for, and the
+        # name is fixed per result so reruns don't churn it
+        df_key = (tuple(df.columns), pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        if st.session_state.get("csv_key") != df_key:
+            st.session_state["csv_key"] = df_key
+            st.session_state["csv_filename"] = f"query_results_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+            st.session_state["csv_ready"] = False
+        if st.button("📄 Prepare CSV"):
+            st.session_state["csv_ready"] = True
+        if st.session_state.get("csv_ready"):
+            st.download_button(
+                label="📥 Download Results as CSV",
+                data=_to_csv(df_key, df),
+                file_name=st.session_state["csv_filename"],
+                mime="text/csv"
+            )
+    
+        # Show sample data insights
+        with st.expander("📊 Data Insights", expanded=False):
+            for col, non_null_count in non_null_counts[non_null_counts > 0].items():
+                st.write(f"**{col}:** {non_null_count}/{len(df)} entries have data")
+    else:
+        st.info("No results found for your query.")
+
+@st.fragment(run_every=30)
 def show_database_status():
     """Show current database status in sidebar"""
     st.subheader("📊 Database Status")
     
     try:
-        from free_query_v3 import SQL_DB_PATH, TABLE_NAME
+        fq = get_fq()
         
-        if os.path.exists(SQL_DB_PATH):
-            conn = sqlite3.connect(SQL_DB_PATH)
-            cur = conn.cursor()
-            
-            # Get table info
-            cur.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
-            row_count = cur.fetchone()[0]
-            
-            cur.execute(f'PRAGMA table_info("{TABLE_NAME}")')
-            columns = [col[1] for col in cur.fetchall()]
-            
-            conn.close()
+        if db_exists():
+            row_count, columns = _fetch_db_status(fq.SQL_DB_PATH, fq.TABLE_NAME, db_mtime())
             
             st.metric("📄 Total Clauses", row_count)
             st.metric("🏷️ Fields", len(columns))
             
             with st.expander("Field Details"):
-                for col in columns:
-                    st.markdown(f"• `{col}`")
+                st.markdown("\n".join(f"- `{col}`" for col in columns))
         else:
             st.info("No database found")
             
@@ -445,13 +660,22 @@ def show_database_status():
 def rebuild_database():
     """Rebuild database from scratch"""
     try:
-        from free_query_v3 import construct_db_from_ledgar, SQL_DB_PATH
+        fq = get_fq()
         
-        if os.path.exists(SQL_DB_PATH):
-            os.remove(SQL_DB_PATH)
+        # Drop the pooled connections before deleting the file they point at
+        close_conns()
+        fq.close_connections()
+        for path in (fq.SQL_DB_PATH, f"{fq.SQL_DB_PATH}-wal", f"{fq.SQL_DB_PATH}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        initialize_database.clear()
+        _fetch_columns.clear()
+        st.session_state.pop("schema", None)
+        invalidate_db_state()
         
         with st.spinner("🔄 Rebuilding database from LEDGAR..."):
-            base_fields, schema = construct_db_from_ledgar()
+            base_fields, schema = fq.construct_db_from_ledgar()
+        invalidate_db_state()
         
         st.success("✅ Database rebuilt successfully!")
         # st.rerun()  # Removed to preserve UI state
@@ -462,23 +686,24 @@ def rebuild_database():
 def run_system_tests():
     """Run the comprehensive test suite"""
     try:
-        from free_query_v3 import run_tests
+        fq = get_fq()
         
         with st.spinner("🧪 Running comprehensive test suite..."):
-            import io
-            from contextlib import redirect_stdout
-            
-            output_buffer = io.StringIO()
+            log_queue = queue.Queue()
+            future = get_pool().submit(_run_captured, get_stdout_proxy(), fq.run_tests, log_queue)
             
-            with redirect_stdout(output_buffer):
-                run_tests()
+            with st.expander("🧪 Test Results", expanded=True):
+                st.write_stream(_stream_log(log_queue))
+            future.result()
             
-            test_output = output_buffer.getvalue()
+            # run_tests() deletes and rebuilds the database file
+            close_conns()
+            initialize_database.clear()
+            _fetch_columns.clear()
+            st.session_state.pop("schema", None)
+            invalidate_db_state()
         
         st.success("✅ Test suite completed!")
-        
-        with st.expander("🧪 Test Results"):
-            st.code(test_output)
             
     except Exception as e:
         st.error(f"Error running tests: {e}")
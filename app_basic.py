@@ -2,8 +2,19 @@ import streamlit as st
 import pandas as pd
 import json
 import sqlite3
+import time
 from typing import Dict, Any, List
 
+# Import the query processor once per process rather than on every rerun
+try:
+    from cached_ops import cached_process_query
+    QUERY_IMPORT_ERROR = None
+except ImportError as e:
+    cached_process_query = None
+    QUERY_IMPORT_ERROR = e
+
+MAX_DISPLAY_ROWS = 200
+
 # Page configuration
 st.set_page_config(
     page_title="Free Query - Legal Document Analysis",
@@ -25,8 +36,9 @@ def check_openai_setup():
     except Exception as e:
         return False, f"Error checking secrets: {e}"
 
+@st.cache_resource(show_spinner=False)
 def test_openai_connection():
-    """Test if OpenAI can be imported and initialized"""
+    """Test if OpenAI can be imported and initialized (probed once per process)"""
     try:
         # Try to import and test the query processor
         from query_processor import check_openai_client
@@ -101,67 +113,71 @@ def main():
     # If everything works, show the main app
     st.success("✅ OpenAI connection successful!")
     
-    # Import query processor only when everything is working
-    try:
-        from query_processor import process_query
-        
-        st.markdown("### 🔍 Query Legal Documents")
-        st.markdown("Ask questions about legal documents in natural language!")
-        
-        # Example queries
-        with st.expander("💡 Example Queries"):
-            st.markdown("""
-            - "Show me clauses with amounts greater than $1000"
-            - "Find clauses mentioning Microsoft"
-            - "What are the termination clauses?"
-            - "Show clauses with effective dates in 2023"
-            """)
-        
-        # Query input
-        user_query = st.text_input(
-            "Enter your query:",
-            placeholder="e.g., Show me clauses with amounts greater than $1000"
-        )
-        
-        col1, col2 = st.columns([1, 4])
-        with col1:
-            process_button = st.button("🚀 Process Query", type="primary")
-        
-        if process_button and user_query:
-            with st.spinner("Processing your query..."):
-                try:
-                    results = process_query(user_query)
+    if cached_process_query is None:
+        st.error(f"Error importing query processor: {QUERY_IMPORT_ERROR}")
+        st.info("There might be an issue with the OpenAI configuration. Please check the setup instructions above.")
+        return
+    
+    st.markdown("### 🔍 Query Legal Documents")
+    st.markdown("Ask questions about legal documents in natural language!")
+    
+    # Example queries
+    with st.expander("💡 Example Queries"):
+        st.markdown("""
+        - "Show me clauses with amounts greater than $1000"
+        - "Find clauses mentioning Microsoft"
+        - "What are the termination clauses?"
+        - "Show clauses with effective dates in 2023"
+        """)
+    
+    query_panel(cached_process_query)
+
+@st.fragment
+def query_panel(process_query):
+    """Query input and results; reruns on its own without re-running the setup checks"""
+    # Query input
+    user_query = st.text_input(
+        "Enter your query:",
+        placeholder="e.g., Show me clauses with amounts greater than $1000"
+    )
+    
+    col1, col2 = st.columns([1, 4])
+    with col1:
+        process_button = st.button("🚀 Process Query", type="primary")
+    
+    if process_button and user_query:
+        with st.spinner("Processing your query..."):
+            try:
+                results = process_query(user_query)
+                
+                if results:
+                    st.success(f"Found {len(results)} results!")
                     
-                    if results:
-                        st.success(f"Found {len(results)} results!")
-                        
-                        # Display results
-                        df = pd.DataFrame(results)
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # Download option
-                        csv = df.to_csv(index=False)
-                        st.download_button(
-                            label="📥 Download Results as CSV",
-                            data=csv,
-                            file_name=f"query_results_{pd.Timestamp.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                            mime="text/csv"
-                        )
-                    else:
-                        st.info("No results found for your query. Try a different query or check if the database has relevant data.")
-                        
-                except Exception as e:
-                    st.error(f"Error processing query: {str(e)}")
-                    with st.expander("🔍 Error Details"):
-                        st.code(str(e))
-                    st.info("Please try a different query or check your API key configuration.")
-        
-        elif process_button and not user_query:
-            st.warning("Please enter a query.")
+                    # Display results (capped; the CSV below has every row)
+                    df = pd.DataFrame(results)
+                    st.dataframe(df.head(MAX_DISPLAY_ROWS), use_container_width=True, height=400, hide_index=True)
+                    if len(df) > MAX_DISPLAY_ROWS:
+                        st.caption(f"Showing the first {MAX_DISPLAY_ROWS} of {len(df)} rows. Download the CSV for the full result set.")
+                    
+                    # Download option
+                    csv = df.to_csv(index=False).encode("utf-8")
+                    st.download_button(
+                        label="📥 Download Results as CSV",
+                        data=csv,
+                        file_name=f"query_results_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+                        mime="text/csv"
+                    )
+                else:
+                    st.info("No results found for your query. Try a different query or check if the database has relevant data.")
+                    
+            except Exception as e:
+                st.error(f"Error processing query: {str(e)}")
+                with st.expander("🔍 Error Details"):
+                    st.code(str(e))
+                st.info("Please try a different query or check your API key configuration.")
     
-    except ImportError as e:
-        st.error(f"Error importing query processor: {e}")
-        st.info("There might be an issue with the OpenAI configuration. Please check the setup instructions above.")
+    elif process_button and not user_query:
+        st.warning("Please enter a query.")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
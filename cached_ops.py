@@ -0,0 +1,118 @@
+"""
+Streamlit-cached wrappers around the LLM-backed query functions.
+
+Repeated submissions of the same query return memoized results instead of
+paying for another OpenAI round trip. List/dict arguments are converted to
+hashable tuples so Streamlit's cache key stays stable across reruns.
+"""
+import sqlite3
+import threading
+
+import streamlit as st
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so trivially different inputs share a cache entry"""
+    return " ".join(query.split())
+
+
+_conn_local = threading.local()
+_conn_lock = threading.Lock()
+_conn_generation = 0
+
+
+def get_conn(db_path: str) -> sqlite3.Connection:
+    """This thread's SQLite connection to `db_path`, opened and tuned once per thread (do not close it)"""
+    with _conn_lock:
+        generation = _conn_generation
+    conns = getattr(_conn_local, "conns", None)
+    if conns is None:
+        conns = _conn_local.conns = {}
+    opened = conns.get(db_path)
+    if opened is not None and opened[0] == generation:
+        return opened[1]
+    if opened is not None:
+        opened[1].close()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conns[db_path] = (generation, conn)
+    return conn
+
+
+def close_conns() -> None:
+    """
+    Retire every get_conn connection; call before deleting or replacing the
+    database file. The caller's are closed now, other threads close theirs on
+    their next get_conn.
+    """
+    global _conn_generation
+    with _conn_lock:
+        _conn_generation += 1
+    conns = getattr(_conn_local, "conns", None) or {}
+    for _, conn in conns.values():
+        conn.close()
+    conns.clear()
+
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_process_query(query: str):
+    """Cached query_processor.process_query"""
+    from query_processor import process_query
+    return process_query(query)
+
+
+# Only the helpers that raise on an API error are memoized: the public
+# free_query_v3 functions turn errors into fallbacks ("miss", "extracted_...",
+# "1=0"), which must not be replayed from the cache for an hour.
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _classify_query(query: str, known_fields: tuple) -> str:
+    """Cached free_query_v3._classify_query; raises on failure"""
+    from free_query_v3 import _classify_query
+    return _classify_query(query, known_fields)
+
+
+def cached_decide_query_type(query: str, known_fields: tuple) -> str:
+    """free_query_v3.decide_query_type with the classifier memoized; known_fields passed as a tuple"""
+    from free_query_v3 import mentions_known_field
+    if not known_fields:
+        return "miss"
+    if mentions_known_field(query, list(known_fields)):
+        return "hit"
+    try:
+        return _classify_query(query, tuple(sorted(known_fields)))
+    except Exception as e:
+        print(f"[Error] Query classification failed: {str(e)}, defaulting to 'miss'")
+        return "miss"
+
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _discover_field(query: str, known_fields: tuple) -> tuple:
+    """Cached free_query_v3._discover_field; raises on failure"""
+    from free_query_v3 import _discover_field
+    return tuple(_discover_field(query, known_fields))
+
+
+def cached_decide_new_field(query: str, known_fields: tuple) -> tuple:
+    """free_query_v3.decide_new_field with field discovery memoized; returns (new_field, parent_field)"""
+    try:
+        return _discover_field(query, tuple(sorted(known_fields)))
+    except Exception as e:
+        print(f"Field discovery failed: {str(e)}")
+        # Same fallback as decide_new_field: a field name derived from the query
+        return "extracted_" + query.lower().replace(" ", "_")[:20], None
+
+
+def cached_generate_filter_sql(query: str, schema_items: tuple, table_name: str) -> str:
+    """
+    free_query_v3.generate_filter_sql; schema passed as tuple(schema.items()).
+    Not memoized here: exact answers are already replayed from llm_cache, and
+    a semantic-cache reuse must not be stored under this query's key.
+    """
+    from free_query_v3 import generate_filter_sql
+    return generate_filter_sql(query, dict(schema_items), table_name)
@@ -5,18 +5,77 @@ Tests various query types and verifies results accuracy
 """
 
 import os
+import re
 import sys
-import sqlite3
+from functools import lru_cache
 from free_query_v3 import (
-    handle_query, load_records, infer_schema_from_records, 
-    generate_filter_sql, SQL_DB_PATH, TABLE_NAME
+    handle_query, read_schema, create_clause_fts, like_to_fts,
+    generate_filter_sql, connect_db, SQL_DB_PATH, TABLE_NAME
 )
 
+# Every test: (name, query, minimum result count, keywords expected in the clause text),
+# grouped under the section header it is reported with
+TEST_SECTIONS = [
+    ('📝 TESTING CONTENT SEARCH QUERIES', [
+        ('Small Company Search', 'Find clauses about small companies', 1, ['small', 'SME', 'small to medium']),
+        ('Termination Search', 'What clauses mention termination?', 1, ['termination', 'terminate', 'early termination']),
+        ('Risk Assessment Search', 'Show me clauses about risk assessment', 1, ['risk', 'assessment', 'risk score']),
+        ('Agreement Duration Search', 'Find clauses about agreement duration', 1, ['duration', 'term', 'period', 'months', 'years']),
+    ]),
+    ('🔢 TESTING NUMERIC QUERIES', [
+        ('High Fee Search', 'Show contracts with fees over $3000', 0, ['$', 'fee', 'pay', 'compensation']),
+        ('Contract Value Search', 'Find contracts worth more than $100,000', 0, ['$', 'value', 'worth', 'amount']),
+    ]),
+    ('🏢 TESTING COMPANY QUERIES', [
+        ('Company Listing', 'Show me all companies', 1, ['Company', 'Corp', 'Inc', 'LLC', 'Technologies']),
+        ('Specific Company Search', 'Find clauses for XYZ Technologies', 0, ['XYZ', 'Technologies']),
+    ]),
+    ('📅 TESTING DATE QUERIES', [
+        ('Date Search', 'What clauses mention dates?', 1, ['2024', '2025', 'January', 'December', 'date']),
+        ('Effective Date Search', 'Find clauses with effective dates', 1, ['effective', 'commence', 'start', 'begin']),
+    ]),
+    ('💰 TESTING FEE QUERIES', [
+        ('Monthly Fee Search', 'Show clauses with monthly fees', 1, ['monthly', 'fee', '$', 'month', 'per month']),
+        ('Payment Terms Search', 'Find payment terms', 1, ['payment', 'pay', 'fee', 'compensation', '$']),
+    ]),
+    ('⚠️ TESTING RISK QUERIES', [
+        ('Risk Level Search', 'What are the risk levels?', 1, ['risk', 'level', 'moderate', 'high', 'low']),
+        ('Risk Score Search', 'Show clauses with risk scores', 1, ['risk score', 'score', 'risk assessment']),
+    ]),
+    ('🔍 TESTING EDGE CASES', [
+        ('Empty Content Search', 'Find clauses about xyz123nonexistent', 0, []),
+        ('Specific Phrase Search', "Find clauses containing 'small to medium-sized enterprise'", 1, ['small to medium-sized enterprise']),
+    ]),
+    ('🔍 TESTING MISS QUERIES (New Field Extraction)', [
+        ('Industry Type Search', 'What industries are mentioned?', 0, ['industry', 'technology', 'software', 'consulting']),
+        ('Liability Search', 'Show me liability clauses', 0, ['liability', 'liable', 'responsibility']),
+    ]),
+]
+TESTS = [test for _, tests in TEST_SECTIONS for test in tests]
+
+@lru_cache(maxsize=64)
+def _keyword_pattern(keywords):
+    """One case-insensitive alternation over all keywords, so each clause is scanned once"""
+    return re.compile("|".join(re.escape(k.lower()) for k in keywords))
+
+def find_keywords(results, columns, expected_keywords):
+    """For each result row whose clause mentions any expected keyword, the first such keyword"""
+    found_keywords = []
+    pattern = _keyword_pattern(tuple(expected_keywords))
+    clause_idx = columns.index('clause') if 'clause' in columns else None
+    for result in results:
+        clause = (result[clause_idx] or '') if clause_idx is not None else ''
+        hits = set(pattern.findall(clause.lower()))
+        if hits:
+            found_keywords.append(next((k for k in expected_keywords if k.lower() in hits), hits.pop()))
+    return found_keywords
+
 class ComprehensiveTestSuite:
     def __init__(self):
         self.test_results = []
         self.total_tests = 0
         self.passed_tests = 0
+        self.conn = None
         
     def run_all_tests(self):
         """Run all comprehensive tests"""
@@ -27,14 +86,11 @@ class ComprehensiveTestSuite:
         self.setup_test_environment()
         
         # Test different query types
-        self.test_content_search_queries()
-        self.test_numeric_queries()
-        self.test_company_queries()
-        self.test_date_queries()
-        self.test_fee_queries()
-        self.test_risk_queries()
-        self.test_edge_cases()
-        self.test_miss_queries()
+        for title, tests in TEST_SECTIONS:
+            print(f"\n{title}")
+            print("-" * 50)
+            for name, query, min_results, keywords in tests:
+                self.execute_test_query(name, query, expected_results_min=min_results, expected_keywords=keywords)
         
         # Print summary
         self.print_summary()
@@ -47,12 +103,18 @@ class ComprehensiveTestSuite:
             print("❌ Database not found. Please run the system first.")
             sys.exit(1)
             
+        # One connection serves every test query, so its page cache stays warm
+        self.conn = connect_db(SQL_DB_PATH)
+        
+        # Content searches are verified through the clause full-text index
+        self.fts = create_clause_fts(SQL_DB_PATH, TABLE_NAME)
+        
         # Load current database state
-        self.records = load_records(SQL_DB_PATH, TABLE_NAME)
-        self.schema = infer_schema_from_records(self.records)
+        self.schema = read_schema(SQL_DB_PATH, TABLE_NAME)
         self.base_fields = [col for col in self.schema if col != "clause"]
         
-        print(f"✅ Database loaded: {len(self.records)} records")
+        record_count = self.conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+        print(f"✅ Database loaded: {record_count} records")
         print(f"   Available fields: {self.base_fields}")
         print(f"   Schema: {list(self.schema.keys())}")
         
@@ -66,9 +128,10 @@ class ComprehensiveTestSuite:
             # Generate SQL to see what's being executed
             where_clause = generate_filter_sql(query, self.schema, TABLE_NAME)
             
-            # Construct the full query
+            # Construct the full query; clause LIKE scans become FTS5 probes
             if where_clause and where_clause.strip() and where_clause != "1=0":
-                full_sql = f"SELECT * FROM {TABLE_NAME} WHERE {where_clause}"
+                filter_sql = like_to_fts(where_clause, TABLE_NAME) if self.fts else where_clause
+                full_sql = f"SELECT * FROM {TABLE_NAME} WHERE {filter_sql}"
             else:
                 full_sql = f"SELECT * FROM {TABLE_NAME}"
             
@@ -92,266 +155,77 @@ class ComprehensiveTestSuite:
                 print("   ⚠️  Skipping full handle_query due to known parameter binding issues")
             
             # Get actual results from database using direct SQL execution
-            conn = sqlite3.connect(SQL_DB_PATH)
-            cur = conn.cursor()
-            cur.execute(full_sql)
+            cur = self.conn.execute(full_sql)
             results = cur.fetchall()
             columns = [description[0] for description in cur.description]
-            conn.close()
-            
-            # Verify results
-            result_count = len(results)
-            print(f"   Results found: {result_count}")
             
-            # Check minimum results requirement
-            if result_count >= expected_results_min:
-                print(f"   ✅ Result count OK (>= {expected_results_min})")
-                count_ok = True
-            else:
-                print(f"   ❌ Too few results (expected >= {expected_results_min})")
-                count_ok = False
-            
-            # Check for expected keywords in results
-            keyword_ok = True
-            found_keywords = []
-            if expected_keywords and results:
-                for result in results:
-                    record = dict(zip(columns, result))
-                    clause = record.get('clause', '').lower()
-                    for keyword in expected_keywords:
-                        if keyword.lower() in clause:
-                            found_keywords.append(keyword)
-                            break
-                
-                if found_keywords:
-                    print(f"   ✅ Keywords found: {found_keywords}")
-                else:
-                    print(f"   ❌ Expected keywords not found: {expected_keywords}")
-                    keyword_ok = False
-            elif expected_keywords:
-                # If we expected keywords but got no results
-                print(f"   ⚠️  No results to check for keywords: {expected_keywords}")
-                keyword_ok = result_count == 0  # Only OK if we expected no results
-            
-            # Overall test result
-            test_passed = count_ok and keyword_ok
-            if test_passed:
-                print(f"   ✅ TEST PASSED")
-                self.passed_tests += 1
-            else:
-                print(f"   ❌ TEST FAILED")
-            
-            # Show sample results
-            if results:
-                print(f"   Sample result:")
-                sample = dict(zip(columns, results[0]))
-                print(f"     Company: {sample.get('company', 'N/A')}")
-                clause = sample.get('clause', '')
-                print(f"     Clause: {clause[:100]}...")
-            
-            self.test_results.append({
-                'name': query_name,
-                'query': query,
-                'passed': test_passed,
-                'result_count': result_count,
-                'expected_min': expected_results_min,
-                'keywords_found': found_keywords if expected_keywords else None
-            })
+            self.verify_results(query_name, query, results, columns, expected_results_min, expected_keywords)
             
         except Exception as e:
             print(f"   ❌ TEST ERROR: {e}")
             import traceback
-            traceback.print_exc()
+            traceback.print_exception(type(e), e, e.__traceback__)
             self.test_results.append({
                 'name': query_name,
                 'query': query,
                 'passed': False,
                 'error': str(e)
             })
-    
-    def test_content_search_queries(self):
-        """Test content-based search queries"""
-        print("\n📝 TESTING CONTENT SEARCH QUERIES")
-        print("-" * 50)
-        
-        # Test small company queries
-        self.execute_test_query(
-            "Small Company Search",
-            "Find clauses about small companies",
-            expected_results_min=1,
-            expected_keywords=['small', 'SME', 'small to medium']
-        )
-        
-        # Test termination queries
-        self.execute_test_query(
-            "Termination Search",
-            "What clauses mention termination?",
-            expected_results_min=1,
-            expected_keywords=['termination', 'terminate', 'early termination']
-        )
-        
-        # Test risk queries
-        self.execute_test_query(
-            "Risk Assessment Search",
-            "Show me clauses about risk assessment",
-            expected_results_min=1,
-            expected_keywords=['risk', 'assessment', 'risk score']
-        )
         
-        # Test agreement duration
-        self.execute_test_query(
-            "Agreement Duration Search",
-            "Find clauses about agreement duration",
-            expected_results_min=1,
-            expected_keywords=['duration', 'term', 'period', 'months', 'years']
-        )
-    
-    def test_numeric_queries(self):
-        """Test numeric-based queries"""
-        print("\n🔢 TESTING NUMERIC QUERIES")
-        print("-" * 50)
-        
-        # Test fee amount queries
-        self.execute_test_query(
-            "High Fee Search",
-            "Show contracts with fees over $3000",
-            expected_results_min=0,  # May or may not have results
-            expected_keywords=['$', 'fee', 'pay', 'compensation']
-        )
-        
-        # Test contract value queries
-        self.execute_test_query(
-            "Contract Value Search",
-            "Find contracts worth more than $100,000",
-            expected_results_min=0,
-            expected_keywords=['$', 'value', 'worth', 'amount']
-        )
-    
-    def test_company_queries(self):
-        """Test company-specific queries"""
-        print("\n🏢 TESTING COMPANY QUERIES")
-        print("-" * 50)
-        
-        # Test company listing
-        self.execute_test_query(
-            "Company Listing",
-            "Show me all companies",
-            expected_results_min=1,
-            expected_keywords=['Company', 'Corp', 'Inc', 'LLC', 'Technologies']
-        )
-        
-        # Test specific company
-        self.execute_test_query(
-            "Specific Company Search",
-            "Find clauses for XYZ Technologies",
-            expected_results_min=0,
-            expected_keywords=['XYZ', 'Technologies']
-        )
-    
-    def test_date_queries(self):
-        """Test date-related queries"""
-        print("\n📅 TESTING DATE QUERIES")
-        print("-" * 50)
-        
-        # Test date mentions
-        self.execute_test_query(
-            "Date Search",
-            "What clauses mention dates?",
-            expected_results_min=1,
-            expected_keywords=['2024', '2025', 'January', 'December', 'date']
-        )
-        
-        # Test effective date
-        self.execute_test_query(
-            "Effective Date Search",
-            "Find clauses with effective dates",
-            expected_results_min=1,
-            expected_keywords=['effective', 'commence', 'start', 'begin']
-        )
-    
-    def test_fee_queries(self):
-        """Test fee-related queries"""
-        print("\n💰 TESTING FEE QUERIES")
-        print("-" * 50)
-        
-        # Test monthly fees
-        self.execute_test_query(
-            "Monthly Fee Search",
-            "Show clauses with monthly fees",
-            expected_results_min=1,
-            expected_keywords=['monthly', 'fee', '$', 'month', 'per month']
-        )
+    def verify_results(self, query_name, query, results, columns, expected_results_min, expected_keywords):
+        """Check one test's rows against its expectations and record the outcome"""
+        # Verify results
+        result_count = len(results)
+        print(f"   Results found: {result_count}")
         
-        # Test payment terms
-        self.execute_test_query(
-            "Payment Terms Search",
-            "Find payment terms",
-            expected_results_min=1,
-            expected_keywords=['payment', 'pay', 'fee', 'compensation', '$']
-        )
-    
-    def test_risk_queries(self):
-        """Test risk-related queries"""
-        print("\n⚠️ TESTING RISK QUERIES")
-        print("-" * 50)
-        
-        # Test risk levels
-        self.execute_test_query(
-            "Risk Level Search",
-            "What are the risk levels?",
-            expected_results_min=1,
-            expected_keywords=['risk', 'level', 'moderate', 'high', 'low']
-        )
-        
-        # Test risk scores
-        self.execute_test_query(
-            "Risk Score Search",
-            "Show clauses with risk scores",
-            expected_results_min=1,
-            expected_keywords=['risk score', 'score', 'risk assessment']
-        )
-    
-    def test_edge_cases(self):
-        """Test edge cases and error handling"""
-        print("\n🔍 TESTING EDGE CASES")
-        print("-" * 50)
+        # Check minimum results requirement
+        if result_count >= expected_results_min:
+            print(f"   ✅ Result count OK (>= {expected_results_min})")
+            count_ok = True
+        else:
+            print(f"   ❌ Too few results (expected >= {expected_results_min})")
+            count_ok = False
         
-        # Test empty query
-        self.execute_test_query(
-            "Empty Content Search",
-            "Find clauses about xyz123nonexistent",
-            expected_results_min=0,
-            expected_keywords=[]
-        )
+        # Check for expected keywords in results
+        keyword_ok = True
+        found_keywords = []
+        if expected_keywords and results:
+            found_keywords = find_keywords(results, columns, expected_keywords)
+            
+            if found_keywords:
+                print(f"   ✅ Keywords found: {found_keywords}")
+            else:
+                print(f"   ❌ Expected keywords not found: {expected_keywords}")
+                keyword_ok = False
+        elif expected_keywords:
+            # If we expected keywords but got no results
+            print(f"   ⚠️  No results to check for keywords: {expected_keywords}")
+            keyword_ok = result_count == 0  # Only OK if we expected no results
         
-        # Test very specific query
-        self.execute_test_query(
-            "Specific Phrase Search",
-            "Find clauses containing 'small to medium-sized enterprise'",
-            expected_results_min=1,
-            expected_keywords=['small to medium-sized enterprise']
-        )
-    
-    def test_miss_queries(self):
-        """Test queries that should trigger new field extraction"""
-        print("\n🔍 TESTING MISS QUERIES (New Field Extraction)")
-        print("-" * 50)
+        # Overall test result
+        test_passed = count_ok and keyword_ok
+        if test_passed:
+            print(f"   ✅ TEST PASSED")
+            self.passed_tests += 1
+        else:
+            print(f"   ❌ TEST FAILED")
         
-        # Test a query that might require new field extraction
-        self.execute_test_query(
-            "Industry Type Search",
-            "What industries are mentioned?",
-            expected_results_min=0,
-            expected_keywords=['industry', 'technology', 'software', 'consulting']
-        )
+        # Show sample results
+        if results:
+            print(f"   Sample result:")
+            sample = dict(zip(columns, results[0]))
+            print(f"     Company: {sample.get('company', 'N/A')}")
+            clause = sample.get('clause', '')
+            print(f"     Clause: {clause[:100]}...")
         
-        # Test liability queries
-        self.execute_test_query(
-            "Liability Search",
-            "Show me liability clauses",
-            expected_results_min=0,
-            expected_keywords=['liability', 'liable', 'responsibility']
-        )
+        self.test_results.append({
+            'name': query_name,
+            'query': query,
+            'passed': test_passed,
+            'result_count': result_count,
+            'expected_min': expected_results_min,
+            'keywords_found': found_keywords if expected_keywords else None
+        })
     
     def print_summary(self):
         """Print test summary"""
@@ -377,6 +251,10 @@ class ComprehensiveTestSuite:
             print("\n🎉 ALL TESTS PASSED! System is working correctly.")
         else:
             print(f"\n⚠️  {self.total_tests - self.passed_tests} test(s) failed. Review the issues above.")
+        
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
 def main():
     """Main test runner"""
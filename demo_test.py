@@ -6,7 +6,7 @@ Demonstrates the system's ability to handle practical legal document queries
 
 import sqlite3
 from free_query_v3 import (
-    generate_filter_sql, load_records, infer_schema_from_records, 
+    generate_filter_sql_many, count_records, read_schema, connect_db, create_clause_fts, like_to_fts,
     SQL_DB_PATH, TABLE_NAME
 )
 
@@ -16,10 +16,10 @@ def demo_legal_queries():
     print("="*60)
     
     # Load database state
-    records = load_records(SQL_DB_PATH, TABLE_NAME)
-    schema = infer_schema_from_records(records)
+    record_count = count_records(SQL_DB_PATH, TABLE_NAME)
+    schema = read_schema(SQL_DB_PATH, TABLE_NAME)
     
-    print(f"📊 Database: {len(records)} legal clauses")
+    print(f"📊 Database: {record_count} legal clauses")
     print(f"📋 Schema: {len(schema)} extracted fields")
     print(f"🔍 Available fields: {', '.join([f for f in schema.keys() if f != 'clause'])}")
     
@@ -67,51 +67,66 @@ def demo_legal_queries():
     print(f"\n🧪 RUNNING {len(demo_queries)} DEMO QUERIES")
     print("-" * 60)
     
-    for category, query, description in demo_queries:
+    # Content searches go through the clause full-text index when this SQLite has FTS5
+    fts = create_clause_fts(SQL_DB_PATH, TABLE_NAME)
+    
+    # One tuned, read-only-workload connection shared by every demo query
+    conn = connect_db(SQL_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    
+    # The queries are independent: generate all their SQL concurrently up front,
+    # then execute and print them in order on the shared connection
+    where_clauses = generate_filter_sql_many([query for _, query, _ in demo_queries], schema, TABLE_NAME)
+    select_all = f"SELECT * FROM {TABLE_NAME}"
+    
+    for (category, query, description), where_clause in zip(demo_queries, where_clauses):
         print(f"\n{category}")
         print(f"   Query: '{query}'")
         print(f"   Purpose: {description}")
         
         try:
-            # Generate and execute SQL
-            where_clause = generate_filter_sql(query, schema, TABLE_NAME)
-            
-            if where_clause and where_clause.strip() and where_clause != "1=0":
-                full_sql = f"SELECT * FROM {TABLE_NAME} WHERE {where_clause}"
+            # Execute the generated SQL
+            w = (where_clause or "").strip().rstrip(";").rstrip()
+            if w and w != "1=0":
+                full_sql = f"{select_all} WHERE {like_to_fts(w, TABLE_NAME) if fts else w}"
             else:
-                full_sql = f"SELECT * FROM {TABLE_NAME}"
+                full_sql = select_all
             
-            conn = sqlite3.connect(SQL_DB_PATH)
-            cur = conn.cursor()
-            cur.execute(full_sql)
-            results = cur.fetchall()
-            columns = [desc[0] for desc in cur.description]
-            conn.close()
+            # Run the filter once: keep the rows that get printed, count the rest off the same cursor
+            results = cur.execute(full_sql).fetchmany(2)
+            result_count = len(results) + sum(1 for _ in cur)
             
-            result_count = len(results)
             print(f"   Results: {result_count} matching clauses")
             
             # Show sample results
             if results:
                 print(f"   Sample matches:")
-                for i, result in enumerate(results[:2]):  # Show first 2 results
-                    record = dict(zip(columns, result))
-                    company = record.get('company', 'N/A')
-                    clause = record.get('clause', '')
+                # Column layout is the same for every row: resolve it once
+                columns = [desc[0] for desc in cur.description]
+                has_company = 'company' in columns
+                extra_cols = [(idx, col) for idx, col in enumerate(columns) if col not in ('clause', 'company')]
+                for i, result in enumerate(results):  # Show first 2 results
+                    company = result['company'] if has_company else 'N/A'
+                    clause = result['clause'] or ''
                     
                     # Extract key information
                     clause_preview = clause[:80] + "..." if len(clause) > 80 else clause
                     print(f"     {i+1}. Company: {company}")
                     print(f"        Clause: {clause_preview}")
                     
-                    # Show relevant extracted fields
+                    # Show up to 3 relevant extracted fields; stop scanning once found
                     relevant_fields = []
-                    for field, value in record.items():
-                        if field not in ['clause', 'company'] and value is not None and str(value).strip():
-                            relevant_fields.append(f"{field}: {value}")
+                    for idx, field in extra_cols:
+                        value = result[idx]
+                        if value is None or (isinstance(value, str) and not value.strip()):
+                            continue
+                        relevant_fields.append(f"{field}: {value}")
+                        if len(relevant_fields) == 3:
+                            break
                     
                     if relevant_fields:
-                        print(f"        Fields: {', '.join(relevant_fields[:3])}")
+                        print(f"        Fields: {', '.join(relevant_fields)}")
                     
                 if result_count > 2:
                     print(f"     ... and {result_count - 2} more results")
@@ -121,6 +136,8 @@ def demo_legal_queries():
         except Exception as e:
             print(f"   ❌ Error: {e}")
     
+    conn.close()
+    
     print(f"\n🎯 SYSTEM CAPABILITIES DEMONSTRATED")
     print("-" * 60)
     print("✅ Content-based search within legal clauses")
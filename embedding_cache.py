@@ -0,0 +1,88 @@
+"""
+In-process semantic cache for natural-language queries.
+
+Exact caches (lru_cache, llm_cache) only help when a query is repeated word
+for word. SemanticCache also reuses an answer when a new query's embedding is
+close enough to one already answered ("high value contracts" vs "contracts
+worth a lot"), as long as both were asked under the same scope (e.g. schema).
+Vectors are L2-normalized, so cosine similarity is a single matrix-vector
+product over the cached entries.
+"""
+import threading
+from typing import Any, Callable, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 1024
+
+
+class SemanticCache:
+    """Query -> value cache matched by embedding cosine similarity within a scope"""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Sequence[Sequence[float]]],
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._clock = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        # Rows are preallocated on the first put; a slot is free while its scope is None
+        self._vectors: Optional[np.ndarray] = None  # (max_entries, dim), one normalized row per slot
+        self._scopes: List[Optional[Hashable]] = [None] * self.max_entries
+        self._values: List[Any] = [None] * self.max_entries
+        self._used = np.zeros(self.max_entries, dtype=np.int64)  # last-use tick per slot, 0 = free
+        self._size = 0
+
+    def _touch(self, slot: int) -> None:
+        self._clock += 1
+        self._used[slot] = self._clock
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embed_fn([text])[0], dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def get(self, vector: np.ndarray, scope: Hashable) -> Optional[Any]:
+        """Value of the most similar entry in `scope`, if it clears the threshold"""
+        with self._lock:
+            if self._vectors is None:
+                return None
+            sims = self._vectors[: self._size] @ vector
+            best, best_sim = None, self.threshold
+            for i in np.flatnonzero(sims >= self.threshold):
+                if sims[i] >= best_sim and self._scopes[i] == scope:
+                    best, best_sim = i, sims[i]
+            if best is None:
+                return None
+            self._touch(best)
+            return self._values[best]
+
+    def put(self, vector: np.ndarray, scope: Hashable, value: Any) -> None:
+        """Store an entry, evicting the least recently used one when full"""
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._used))
+            self._vectors[slot] = vector
+            self._scopes[slot] = scope
+            self._values[slot] = value
+            self._touch(slot)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
@@ -1,6 +1,9 @@
 import sqlite3
 import json
-from query_processor import extract_fields_from_clause, store_records_sql
+import re
+from concurrent.futures import ThreadPoolExecutor
+from query_processor import extract_fields_from_clause, store_records_sql, create_schema_indexes
+from free_query_v3 import create_clause_fts
 
 FIELDS = [
     "company",
@@ -19,13 +22,47 @@ FIELDS = [
 
 DB_PATH = "clauses.db"
 TABLE_NAME = "clauses"
+EXTRACT_WORKERS = 20
+
+# Stored as REAL so numeric filters compare (and use indexes) without a per-row CAST
+NUMERIC_FIELDS = {"amount", "fee", "risk_score", "term_length"}
+# Money fields, where "$3.5M" means 3,500,000
+SCALED_FIELDS = {"amount", "fee"}
+# A standalone number, not glued to a word or another number (so "net-30" and
+# "3000-5000" are not read as negatives): an optional sign and currency symbol,
+# then an optional K/M/B (thousand/million/billion) multiplier
+_NUMBER = re.compile(
+    r"(?<![\w.\-])([-+]?)[$€£]?(\d+(?:\.\d+)?|\.\d+)"
+    r"(?:\s*(k|m|b|mm|bn|thousand|million|billion)\b)?(?![\w\-]|\.\d)",
+    re.IGNORECASE,
+)
+_MULTIPLIERS = {"k": 1e3, "thousand": 1e3, "m": 1e6, "mm": 1e6, "million": 1e6, "b": 1e9, "bn": 1e9, "billion": 1e9}
+
+
+def parse_number(value, scaled=True):
+    """
+    The single number in `value` as a float, or None if there is none or more
+    than one. With scaled=False a K/M/B suffix is ambiguous ("12 m" may be
+    months), so the value is None.
+    """
+    matches = _NUMBER.findall(value.replace(",", ""))
+    if len(matches) != 1:
+        return None
+    sign, digits, suffix = matches[0]
+    if suffix and not scaled:
+        return None
+    number = float(digits) * _MULTIPLIERS.get(suffix.lower(), 1)
+    return -number if sign == "-" else number
 
 
 def clean_record(record):
     """Clean record to handle list values and other SQLite incompatible types."""
     cleaned = {}
     for key, value in record.items():
-        if isinstance(value, list):
+        if key in NUMERIC_FIELDS and isinstance(value, str):
+            # "$3,000", "$3.5M", "12 months" -> 3000.0 / 3500000.0 / 12.0; unparseable or ambiguous -> NULL
+            cleaned[key] = parse_number(value, scaled=key in SCALED_FIELDS)
+        elif isinstance(value, list):
             # Convert lists to JSON strings
             cleaned[key] = json.dumps(value)
         elif isinstance(value, dict):
@@ -46,14 +83,18 @@ def main():
 
     print(f"Extracting fields for {len(clauses)} clauses...")
     records = []
-    for i, clause in enumerate(clauses):
-        print(f"Processing clause {i+1}/{len(clauses)}...")
-        record = extract_fields_from_clause(clause, FIELDS)
-        cleaned_record = clean_record(record)
-        records.append(cleaned_record)
+    # The per-clause LLM calls are independent; keep EXTRACT_WORKERS of them in flight
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as ex:
+        extracted = ex.map(lambda clause: clean_record(extract_fields_from_clause(clause, FIELDS)), clauses)
+        for i, cleaned_record in enumerate(extracted):
+            print(f"Processed clause {i+1}/{len(clauses)}")
+            records.append(cleaned_record)
 
     print("Storing structured records in the database...")
-    store_records_sql(records, DB_PATH, TABLE_NAME)
+    schema = store_records_sql(records, DB_PATH, TABLE_NAME)
+    # The table was recreated: index the extracted fields and rebuild the clause full-text index
+    create_schema_indexes(DB_PATH, TABLE_NAME, schema)
+    create_clause_fts(DB_PATH, TABLE_NAME, rebuild=True)
     print("Done! The database is now structured and ready for querying.")
 
 if __name__ == "__main__":
@@ -1,19 +1,29 @@
+import csv
 import json
 import os
 import sqlite3
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import orjson
 from openai import OpenAI
 
+import llm_cache
+from free_query_v3 import load_ledgar_provisions
+from http_pool import pooled_http_client
+
+# Every agent shares one client and its keep-alive connection pool
+http_client = pooled_http_client()
+
 # Try to import streamlit for secrets, fallback to environment variable
 try:
     import streamlit as st
     # For Streamlit Cloud deployment
-    oai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+    oai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client)
 except (ImportError, KeyError):
     # For local development - you can set this as an environment variable
     # or temporarily put your key here for local testing
     api_key = os.environ.get('OPENAI_API_KEY', 'your_api_key_here_for_local_testing')
-    oai_client = OpenAI(api_key=api_key)
+    oai_client = OpenAI(api_key=api_key, http_client=http_client)
 
 # -------------------------
 # File paths and settings
@@ -23,38 +33,45 @@ LEDGAR_PATH = "synthetic_clauses.jsonl"
 CLAUSE_LIMIT = 100  # for testing; remove or adjust as needed
 SQL_DB_PATH = "clauses.db"
 TABLE_NAME = "clauses"
+EXTRACT_WORKERS = 20  # concurrent per-clause extraction requests
+
+@lru_cache(maxsize=32)
+def build_extraction_schema(fields):
+    """Structured-output JSON schema (keys use underscores) and prompt field list for a tuple of fields, built once per field set"""
+    properties = {field.replace(" ", "_"): {"type": "string"} for field in fields}
+    schema = {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties.keys()),
+        "additionalProperties": False
+    }
+    return schema, ", ".join(fields)
 
 # -------------------------
 # Step 1: Load or Extract LEDGAR clauses
 # -------------------------
 if not os.path.exists(BASE_INFO_PATH):
     print("Extracting base information from LEDGAR data...")
-    with open(LEDGAR_PATH, "r") as f:
-        # Limit to CLAUSE_LIMIT clauses for this example
-        clauses = [json.loads(line)['provision'] for line in f.readlines()][:CLAUSE_LIMIT]
+    # Limit to CLAUSE_LIMIT clauses for this example; only those lines are read and decoded
+    clauses = load_ledgar_provisions(LEDGAR_PATH, CLAUSE_LIMIT, os.path.getmtime(LEDGAR_PATH))
 
     # -------------------------
     # Extraction Agent (Structured)
     # -------------------------
     def extract_clause_info_structured(clause, fields):
-        # Build a JSON schema from the given fields (ensuring keys use underscore)
-        properties = {}
-        for field in fields:
-            field_key = field.replace(" ", "_")
-            properties[field_key] = {"type": "string"}
-        schema = {
-            "type": "object",
-            "properties": properties,
-            "required": list(properties.keys()),
-            "additionalProperties": False
-        }
+        key = llm_cache.cache_key("gpt-4o-mini", "free_query.extract_clause_info_structured", clause, fields)
+        cached = llm_cache.get(key)
+        if cached is not None:
+            return cached
+
+        schema, fields_str = build_extraction_schema(tuple(fields))
         
         response = oai_client.responses.create(
             model="gpt-4o-mini",
             input=[
                 {"role": "system", "content": "Extract clause information using a JSON schema."},
                 {"role": "user", "content": (
-                    f"Extract the following fields from the clause if they exist: {', '.join(fields)}. "
+                    f"Extract the following fields from the clause if they exist: {fields_str}. "
                     f"If any field is not present, return null. Clause: '''{clause}'''"
                 )}
             ],
@@ -68,7 +85,8 @@ if not os.path.exists(BASE_INFO_PATH):
             }
         )
         try:
-            result = json.loads(response.output_text)
+            result = orjson.loads(response.output_text)
+            llm_cache.put(key, {**result, "clause": clause})
         except Exception as e:
             print("Error parsing structured output:", e)
             result = {field.replace(" ", "_"): None for field in fields}
@@ -78,33 +96,81 @@ if not os.path.exists(BASE_INFO_PATH):
 
     # Set base extraction fields (use underscore style keys)
     base_fields = ["date", "money", "company_name"]
-    extracted = [extract_clause_info_structured(clause, base_fields) for clause in clauses]
-    df_base = pd.DataFrame(extracted)
-    df_base.to_csv(BASE_INFO_PATH, index=False)
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as ex:
+        extracted = list(ex.map(lambda clause: extract_clause_info_structured(clause, base_fields), clauses))
+    base_records = extracted
+    with open(BASE_INFO_PATH, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(base_records[0].keys()))
+        writer.writeheader()
+        writer.writerows(base_records)
 else:
     print("Loading extracted base information from CSV...")
-    df_base = pd.read_csv(BASE_INFO_PATH)
-    base_fields = [col for col in df_base.columns if col != "clause"]
+    with open(BASE_INFO_PATH, newline="") as f:
+        reader = csv.DictReader(f)
+        # Empty cells were nulls when the CSV was written
+        base_records = [{k: (v if v != "" else None) for k, v in row.items()} for row in reader]
+        base_fields = [col for col in reader.fieldnames if col != "clause"]
 
 print("Currently extracted fields:", base_fields)
 
 # -------------------------
 # Step 2: Store Data into SQL
 # -------------------------
-def store_data_in_sql(df, db_path, table_name):
-    conn = sqlite3.connect(db_path)
-    # Replace the table if it already exists
-    df.to_sql(table_name, conn, if_exists="replace", index=False)
-    conn.close()
+def sql_column_type(values):
+    """REAL when every non-null value is a number, TEXT otherwise"""
+    present = [v for v in values if v is not None]
+    if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return "REAL"
+    return "TEXT"
+
+def store_data_in_sql(records, db_path, table_name):
+    # The table is rebuilt from the records on every run, so the bulk load can skip fsyncs
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    cols = list(dict.fromkeys(col for record in records for col in record))
+    cols_ddl = ", ".join(f'"{col}" {sql_column_type(r.get(col) for r in records)}' for col in cols)
+    quoted_cols = ", ".join(f'"{col}"' for col in cols)
+    placeholders = ", ".join("?" for _ in cols)
+    rows = ([record.get(col) for col in cols] for record in records)
+    try:
+        # Replace the table if it already exists: one transaction, one batched insert
+        conn.execute("BEGIN")
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        # The clause full-text index would keep pointing at the old rowids
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}_fts"')
+        conn.execute(f'CREATE TABLE "{table_name}" ({cols_ddl})')
+        conn.executemany(f'INSERT INTO "{table_name}" ({quoted_cols}) VALUES ({placeholders})', rows)
+        # Index the extracted fields the generated filters compare against
+        for col in cols:
+            if col != "clause":
+                conn.execute(f'CREATE INDEX "idx_{table_name}_{col}" ON "{table_name}"("{col}")')
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
     print(f"Data stored into SQL table '{table_name}' in database {db_path}.")
 
-store_data_in_sql(df_base, SQL_DB_PATH, TABLE_NAME)
+store_data_in_sql(base_records, SQL_DB_PATH, TABLE_NAME)
 
 # -------------------------
 # Agent 1: Query Decision Agent
 # -------------------------
 def decide_query_type(query, known_fields):
     print("Known fields:", known_fields)
+    # Naming a known field is a hit without asking the LLM
+    ql = query.lower()
+    if any(field.lower() in ql or field.replace("_", " ") in ql for field in known_fields):
+        print("[Query Decision Agent] Query decision: hit (known field mentioned)")
+        return "hit"
+    key = llm_cache.cache_key("gpt-4o-mini", "free_query.decide_query_type", query, known_fields)
+    decision = llm_cache.get(key)
+    if decision is not None:
+        print(f"[Query Decision Agent] Query decision: {decision}")
+        return decision
     prompt = (f'''We have a dataset of legal documents with the extracted fields: {', '.join(known_fields)}. 
 Determine if the query: '{query}' is asking for information that is already extracted (a "hit") or is asking for a field that is not yet extracted (a "miss"). 
 Return only the word "hit" or "miss".''')
@@ -119,6 +185,7 @@ Return only the word "hit" or "miss".''')
         decision = response.choices[0].message.content.strip().lower()
         if decision not in ["hit", "miss"]:
             raise ValueError("Invalid decision response")
+        llm_cache.put(key, decision)
     except Exception as e:
         print("Decision agent error:", e)
         decision = "hit" if any(field.lower() in query.lower() for field in known_fields) else "miss"
@@ -128,6 +195,13 @@ Return only the word "hit" or "miss".''')
 # -------------------------
 # Agent 2: SQL Query Generation Agent with Schema Information
 # -------------------------
+SQL_SCHEMA = {
+    "type": "object",
+    "properties": {"sql": {"type": "string"}},
+    "required": ["sql"],
+    "additionalProperties": False
+}
+
 def generate_filter_sql(query, field, table_name="clauses"):
     # Build a description of the table schema
     if table_name == "clauses":
@@ -137,20 +211,35 @@ def generate_filter_sql(query, field, table_name="clauses"):
         # For dynamically extracted new field tables
         schema_description = f"Table {table_name} schema: clause (TEXT), {field} (TEXT)."
     
+    key = llm_cache.cache_key("gpt-4o-mini", "free_query.generate_sql", query, schema_description, table_name)
+    sql_code = llm_cache.get(key)
+    if sql_code is not None:
+        return sql_code
+
     prompt = (
         f"Given the SQL table structure: {schema_description} "
         f"Based on the query: '{query}', generate SQL code to retrieve rows from the table '{table_name}'. "
-        f"Return only the SQL query in a triple-quoted string."
+        f"Put the bare SQL query in the 'sql' field."
     )
     try:
-        response = oai_client.chat.completions.create(
+        # Structured output: the SQL comes back as a JSON string, with no fences or quoting to strip
+        response = oai_client.responses.create(
             model="gpt-4o-mini",
-            messages=[
+            input=[
                 {"role": "system", "content": "You are a SQL query generation agent."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            text={
+                "format": {
+                    "type": "json_schema",
+                    "name": "gen_sql",
+                    "schema": SQL_SCHEMA,
+                    "strict": True
+                }
+            }
         )
-        sql_code = response.choices[0].message.content.strip()
+        sql_code = orjson.loads(response.output_text)["sql"].strip()
+        llm_cache.put(key, sql_code)
     except Exception as e:
         print("SQL generation error:", e)
 
@@ -160,7 +249,6 @@ def generate_filter_sql(query, field, table_name="clauses"):
 # Agent 3: SQL Execution Agent
 # -------------------------
 def execute_generated_sql(sql_code, db_path):
-    sql_code = sql_code.replace('```sql', '').replace('```', '')
     print(f"Executing SQL:\n{sql_code}\n")
     try:
         conn = sqlite3.connect(db_path)
@@ -168,10 +256,12 @@ def execute_generated_sql(sql_code, db_path):
         rows = cursor.fetchall()
         # Get column names from the cursor description, if available
         columns = [description[0] for description in cursor.description] if cursor.description else []
-        result_df = pd.DataFrame(rows, columns=columns)
         conn.close()
         print("[SQL Execution Agent] Query executed successfully. Results:")
-        print(result_df)
+        print(columns)
+        print("\n".join(map(str, rows[:20])))
+        if len(rows) > 20:
+            print(f"... {len(rows) - 20} more rows")
     except Exception as e:
         print("SQL execution error:", e)
 
@@ -194,28 +284,23 @@ def handle_query(query):
         new_field = query.lower().split()[-1]
         print(f"[Miss] New field '{new_field}' extraction initiated.")
         
-        # Re-read original LEDGAR clauses if needed
-        with open(LEDGAR_PATH, "r") as f:
-            clauses = [json.loads(line)['provision'] for line in f.readlines()][:CLAUSE_LIMIT]
+        # Original LEDGAR clauses, parsed once per process
+        clauses = load_ledgar_provisions(LEDGAR_PATH, CLAUSE_LIMIT, os.path.getmtime(LEDGAR_PATH))
         
         def extract_new_field(clause, fields):
-            properties = {}
-            for field in fields:
-                field_key = field.replace(" ", "_")
-                properties[field_key] = {"type": "string"}
-            schema = {
-                "type": "object",
-                "properties": properties,
-                "required": list(properties.keys()),
-                "additionalProperties": False
-            }
+            key = llm_cache.cache_key("gpt-o3-mini", "free_query.extract_new_field", clause, fields)
+            cached = llm_cache.get(key)
+            if cached is not None:
+                return cached
+
+            schema, fields_str = build_extraction_schema(tuple(fields))
             
             response = oai_client.responses.create(
                 model="gpt-o3-mini",
                 input=[
                     {"role": "system", "content": "Extract clause information using a JSON schema."},
                     {"role": "user", "content": (
-                        f"Extract the following field from the clause if it exists: {', '.join(fields)}. "
+                        f"Extract the following field from the clause if it exists: {fields_str}. "
                         f"If the field is not present, return null. Clause: '''{clause}'''"
                     )}
                 ],
@@ -229,17 +314,18 @@ def handle_query(query):
                 }
             )
             try:
-                result = json.loads(response.output_text)
+                result = orjson.loads(response.output_text)
+                llm_cache.put(key, {**result, "clause": clause})
             except Exception as e:
                 print("Error parsing structured output for new field:", e)
                 result = {field.replace(" ", "_"): None for field in fields}
             result["clause"] = clause
             return result
         
-        new_data = [extract_new_field(clause, [new_field]) for clause in clauses]
-        df_new = pd.DataFrame(new_data)
+        with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as ex:
+            new_data = list(ex.map(lambda clause: extract_new_field(clause, [new_field]), clauses))
         new_table = f"extracted_{new_field}"
-        store_data_in_sql(df_new, SQL_DB_PATH, new_table)
+        store_data_in_sql(new_data, SQL_DB_PATH, new_table)
         
         sql_code = generate_filter_sql(query, new_field, table_name=new_table)
         execute_generated_sql(sql_code, SQL_DB_PATH)
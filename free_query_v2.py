@@ -1,14 +1,24 @@
+import hashlib
 import json
 import os
+import re
 import sqlite3
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
 from typing import Optional, List, Dict, Any
 
+import numpy as np
+import orjson
+
 from pydantic import BaseModel, create_model
 from openai import OpenAI
 from tqdm import tqdm
 
+from sql_utils import SQL_FENCE
+
 # Try to import streamlit for secrets, fallback to environment variable
 try:
     import streamlit as st
@@ -27,15 +37,17 @@ LEDGAR_PATH  = "synthetic_clauses.jsonl"
 CLAUSE_LIMIT = 10
 SQL_DB_PATH  = "clauses.db"
 TABLE_NAME   = "clauses"
+EXTRACT_WORKERS = 16   # concurrent extraction requests
+CLAUSE_SEED  = 42      # fixed seed so the MISS-branch clause augmentation is reproducible
 
 # -------------------------
 # Utility Functions
 # -------------------------
-def random_date() -> str:
+def random_date(rng: random.Random = random) -> str:
     start = datetime(2000, 1, 1)
     end   = datetime(2030, 12, 31)
     delta_days = (end - start).days
-    res = (start + timedelta(days=random.randint(0, delta_days))).strftime("%Y-%m-%d")
+    res = (start + timedelta(days=rng.randint(0, delta_days))).strftime("%Y-%m-%d")
     # print(res)
     return res
 
@@ -53,48 +65,24 @@ def _try_parse_date(s: str) -> bool:
     except:
         return False
 
+_DATE_COLUMN = re.compile(r"date|_at$", re.IGNORECASE)
+
 def infer_sql_column_type_rule_list(
     values: List[Any], column_name: str, threshold: float = 0.8
 ) -> str:
     """
-    Use LLM to infer SQL column type based on column name and sample values.
-    Returns "REAL", "DATE", or "TEXT".
+    Infer SQL column type from the values: "REAL" / "DATE" when at least
+    `threshold` of the non-null values parse as numbers / ISO dates, else
+    "TEXT". A column with no values falls back on its name.
     """
-    try:
-        # Get a sample of values (up to 5) for context
-        sample_values = [str(v) for v in values if v is not None][:5]
-        sample_str = ", ".join(sample_values) if sample_values else "No values"
-
-        prompt = f"""
-        Given a column named '{column_name}' with sample values: [{sample_str}]
-        Determine the most appropriate SQL column type from these options:
-        - REAL: for numeric values, including money amounts
-        - DATE: for date values in any format
-        - TEXT: for any other type of data
-
-        Return ONLY one of these exact words: REAL, DATE, or TEXT
-        """
-
-        response = oai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a SQL schema inference agent. Return only the type name."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        result = response.choices[0].message.content.strip().upper()
-        
-        # Validate the response is one of the expected types
-        if result not in ["REAL", "DATE", "TEXT"]:
-            print(f"[Warning] LLM returned unexpected type '{result}', defaulting to TEXT")
-            return "TEXT"
-            
-        return result
-
-    except Exception as e:
-        print(f"[Error] Type inference failed: {str(e)}, defaulting to TEXT")
-        return "TEXT"
+    present = [str(v) for v in values if v is not None]
+    if not present:
+        return "DATE" if _DATE_COLUMN.search(column_name) else "TEXT"
+    if sum(map(_try_parse_float, present)) >= threshold * len(present):
+        return "REAL"
+    if sum(map(_try_parse_date, present)) >= threshold * len(present):
+        return "DATE"
+    return "TEXT"
 
 # -------------------------
 # SQL Storage (sqlite3 only)
@@ -116,26 +104,35 @@ def store_records_sql(
         vals = [r[col] for r in records if r.get(col) is not None]
         schema[col] = infer_sql_column_type_rule_list(vals, col)
 
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     cur  = conn.cursor()
 
-    # Re-create table
     cols_ddl = []
     for col, dtype in schema.items():
         sql_type = "REAL" if dtype == "REAL" else "TEXT"
         cols_ddl.append(f"{col} {sql_type}")
-    ddl = f"DROP TABLE IF EXISTS {table_name}; CREATE TABLE {table_name} ({', '.join(cols_ddl)});"
-    cur.executescript(ddl)
 
-    # Bulk insert
     cols_list    = list(sample.keys())
     placeholders = ", ".join("?" for _ in cols_list)
     insert_sql   = f"INSERT INTO {table_name} ({', '.join(cols_list)}) VALUES ({placeholders})"
     rows         = [[r.get(col) for col in cols_list] for r in records]
-    cur.executemany(insert_sql, rows)
 
-    conn.commit()
-    conn.close()
+    # Re-create table and bulk insert in one transaction (a single fsync)
+    try:
+        cur.execute("BEGIN")
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        # The clause full-text index would keep pointing at the old rowids
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}_fts")
+        cur.execute(f"CREATE TABLE {table_name} ({', '.join(cols_ddl)})")
+        cur.executemany(insert_sql, rows)
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
 
     print(f"Stored {len(rows)} rows into '{table_name}' with schema: {schema}")
     return schema
@@ -200,7 +197,7 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
         
         # Extract the response text and parse as JSON
         response_text = response.choices[0].message.content
-        result = json.loads(response_text)
+        result = orjson.loads(response_text)
         print(clause)
         print(result)
         
@@ -211,7 +208,7 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
         result['clause'] = clause
         return result
         
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"[Error] Failed to parse JSON response: {e}")
         print(f"[Error] Raw response: {response_text}")
         # Return a dictionary with None values for all fields
@@ -222,12 +219,64 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
         # Return a dictionary with None values for all fields
         return {field: None for field in fields}
 
+def extract_fields_from_clauses(clauses: List[str], fields: List[str]) -> List[Dict[str, Any]]:
+    """
+    Run extract_fields_from_clause over many clauses concurrently.
+    Each call is network-bound, so a thread pool overlaps the round trips;
+    results come back in the same order as the input clauses.
+    """
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as ex:
+        return list(tqdm(ex.map(lambda c: extract_fields_from_clause(c, fields), clauses),
+                         total=len(clauses)))
+
+def _clause_hash(clause: str) -> str:
+    return hashlib.blake2b(clause.encode(), digest_size=8).hexdigest()
+
+def extract_field_cached(clauses: List[str], field: str, db_path: str = SQL_DB_PATH) -> List[Dict[str, Any]]:
+    """
+    Extract one field from every clause, reusing values from earlier MISS runs.
+    Results are kept in the `field_cache` table keyed by (clause_hash, field);
+    only clauses without a cached value go to the LLM.
+    """
+    hashes = [_clause_hash(c) for c in clauses]
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS field_cache ("
+            "clause_hash TEXT, field TEXT, value TEXT, PRIMARY KEY (clause_hash, field))"
+        )
+        cached = dict(conn.execute(
+            "SELECT clause_hash, value FROM field_cache WHERE field = ?", (field,)
+        ))
+
+        missing = [c for c, h in zip(clauses, hashes) if h not in cached]
+        print(f"[Cache] {len(clauses) - len(missing)}/{len(clauses)} clauses already have '{field}'")
+        fresh = dict(zip(missing, extract_fields_from_clauses(missing, [field]))) if missing else {}
+
+        # Only successful extractions (those carrying the clause back) are cached
+        new_rows = [
+            (_clause_hash(c), field, orjson.dumps(r.get(field)).decode())
+            for c, r in fresh.items() if "clause" in r
+        ]
+        if new_rows:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT OR REPLACE INTO field_cache VALUES (?, ?, ?)", new_rows)
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    return [
+        {field: orjson.loads(cached[h]), "clause": c} if h in cached else fresh[c]
+        for c, h in zip(clauses, hashes)
+    ]
+
 # -------------------------
 # Step 1: Construct DB from LEDGAR
 # -------------------------
 def construct_db_from_ledgar() -> (List[str], Dict[str, str]):
-    with open(LEDGAR_PATH, "r") as f:
-        raw = [json.loads(line)["provision"] for line in f][:CLAUSE_LIMIT]
+    with open(LEDGAR_PATH, "rb") as f:
+        raw = [orjson.loads(line)["provision"] for line in islice(f, CLAUSE_LIMIT)]
 
     # 50% randomly append " effective date: YYYY-MM-DD"
     clauses = [
@@ -242,7 +291,7 @@ def construct_db_from_ledgar() -> (List[str], Dict[str, str]):
 
 
     base_fields = ['company']
-    records = [extract_fields_from_clause(c, base_fields) for c in tqdm(clauses)]
+    records = extract_fields_from_clauses(clauses, base_fields)
     schema  = store_records_sql(records, SQL_DB_PATH, TABLE_NAME)
     return base_fields, schema
 
@@ -295,7 +344,7 @@ def generate_filter_sql(
         return f'''SELECT * FROM {table_name} LIMIT 10;'''
 
 def execute_generated_sql(sql_code: str, db_path: str):
-    sql = sql_code.replace("```sql", "").replace("```", "").strip().strip('"""')
+    sql = SQL_FENCE.sub("", sql_code).strip()
     print(f"Executing SQL:\n{sql}\n")
     conn = sqlite3.connect(db_path)
     cur  = conn.cursor()
@@ -323,28 +372,40 @@ def decide_new_field(query: str) -> str:
     except:
         return "new_field"
 
+@lru_cache(maxsize=1)
+def load_clauses() -> tuple:
+    """
+    Read the first CLAUSE_LIMIT LEDGAR provisions and append a random
+    effective date to ~50% of them. Seeded, so every run (and every MISS
+    query) sees the same clause texts; memoized for the process lifetime.
+    """
+    with open(LEDGAR_PATH, "rb") as f:
+        raw = [orjson.loads(line)["provision"] for line in islice(f, CLAUSE_LIMIT)]
+    rng  = random.Random(CLAUSE_SEED)
+    # 50% randomly append " effective date: YYYY-MM-DD" (one vectorized draw)
+    mask = np.random.default_rng(CLAUSE_SEED).integers(0, 2, size=len(raw), dtype=np.uint8).astype(bool)
+    suffixes = [f" effective date: {random_date(rng)}" if m else "" for m in mask]
+    return tuple(map(str.__add__, raw, suffixes))
+
+def run_filter_query(query: str, schema: Dict[str, str], table_name: str):
+    """Generate SQL for the query against one table and execute it."""
+    sql = generate_filter_sql(query, schema, table_name)
+    execute_generated_sql(sql, SQL_DB_PATH)
+
 def handle_query(query: str, base_fields: List[str], schema: Dict[str, str]):
     decision = decide_query_type(query, base_fields)
     if decision == "hit":
-        sql = generate_filter_sql(query, schema, TABLE_NAME)
-        execute_generated_sql(sql, SQL_DB_PATH)
+        table_name = TABLE_NAME
     else:
         new_field = decide_new_field(query)
         print(f"[Miss] extracting new field: {new_field}")
 
-        with open(LEDGAR_PATH, "r") as f:
-            raw = [json.loads(line)["provision"] for line in f][:CLAUSE_LIMIT]
-        clauses = [
-            c + (f" effective date: {random_date()}" if random.random() < 0.5 else "")
-            for c in raw
-        ]
-
-        records   = [extract_fields_from_clause(c, [new_field]) for c in tqdm(clauses)]
-        new_table = f"extracted_{new_field}"
-        new_schema = store_records_sql(records, SQL_DB_PATH, new_table)
+        clauses    = list(load_clauses())
+        records    = extract_field_cached(clauses, new_field)
+        table_name = f"extracted_{new_field}"
+        schema     = store_records_sql(records, SQL_DB_PATH, table_name)
 
-        sql = generate_filter_sql(query, new_schema, new_table)
-        execute_generated_sql(sql, SQL_DB_PATH)
+    run_filter_query(query, schema, table_name)
 
 # -------------------------
 # Main
@@ -1,22 +1,40 @@
-import json
+import atexit
 import os
+import re
 import sqlite3
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
 from typing import Optional, List, Dict, Any
 
-from pydantic import BaseModel, create_model
-from openai import OpenAI
+import orjson
 from tqdm import tqdm
 
+import llm_cache
+from http_pool import pooled_http_client
+from sql_utils import insert_rows
+
 # Try to import streamlit for secrets, fallback to environment variable
+@lru_cache(maxsize=1)
 def get_openai_client():
-    """Get OpenAI client with proper API key handling"""
+    """
+    Get OpenAI client with proper API key handling. Built once per process and
+    shared by every agent, so all calls reuse one pool of keep-alive
+    connections (HTTP/2 when the h2 package is installed) instead of paying a
+    new TLS handshake per request.
+    """
+    # Imported here so SQL-only users of this module (demo/test scripts) skip the SDK's import cost
+    from openai import OpenAI
+    http_client = pooled_http_client()
     try:
         import streamlit as st
         # For Streamlit Cloud deployment - check if secrets are available
         if hasattr(st, 'secrets') and "OPENAI_API_KEY" in st.secrets:
-            return OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+            return OpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client, max_retries=LLM_MAX_RETRIES)
         else:
             # Streamlit is available but secrets are not configured
             raise KeyError("OPENAI_API_KEY not in streamlit secrets")
@@ -26,10 +44,7 @@ def get_openai_client():
         api_key = os.environ.get('OPENAI_API_KEY')
         if not api_key:
             api_key = 'your_api_key_here_for_local_testing'
-        return OpenAI(api_key=api_key)
-
-# Legacy support - but we'll use get_openai_client() in functions
-oai_client = get_openai_client()
+        return OpenAI(api_key=api_key, http_client=http_client, max_retries=LLM_MAX_RETRIES)
 
 # -------------------------
 # File paths and settings
@@ -39,9 +54,90 @@ CLAUSE_LIMIT = 10
 SQL_DB_PATH  = "clauses.db"
 TABLE_NAME   = "clauses"
 
+# Upper bound on LLM requests this module keeps in flight at once
+LLM_CONCURRENCY = 10
+_llm_pool = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY)
+# Retries (the SDK backs off exponentially and honours Retry-After) for 429s/5xx under concurrent load
+LLM_MAX_RETRIES = 5
+
+# construct_db_from_ledgar extracts through the Batch API above this many clauses
+BATCH_THRESHOLD = 100
+BATCH_POLL_SECONDS = 30
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# WAL lets the UI's status/preview reads run alongside extraction writes;
+# busy_timeout waits out a held write lock instead of failing with "database is locked"
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA busy_timeout=5000; "
+    "PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536;"
+)
+
 # -------------------------
 # Utility Functions
 # -------------------------
+def connect_db(db_path: str = SQL_DB_PATH, **kwargs) -> sqlite3.Connection:
+    """Open a SQLite connection with the shared pragmas applied"""
+    conn = sqlite3.connect(db_path, **kwargs)
+    conn.executescript(SQLITE_PRAGMAS)
+    return conn
+
+# Helper connections are opened once per thread and path and then reused, so
+# store/load/query calls skip the connect + PRAGMA bootstrap and sqlite3's
+# statement cache can reuse compiled SQL. A replaced database file (a change
+# of inode, size or mtime; inodes alone can be reused after a delete) or
+# close_connections() makes the next call reopen. Only the owning thread
+# ever closes a connection, so none is closed while another thread uses it.
+_conn_local = threading.local()
+_conn_lock = threading.Lock()
+_conn_generation = 0
+
+def _file_identity(path: str) -> Optional[tuple]:
+    """Device, inode, size and mtime of a database file, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+def _thread_conn(db_path: str) -> sqlite3.Connection:
+    """This thread's reusable connection to `db_path` (do not close it)"""
+    with _conn_lock:
+        generation = _conn_generation
+    path = os.path.abspath(db_path)
+    identity = _file_identity(path)
+    conns = getattr(_conn_local, "conns", None)
+    if conns is None:
+        conns = _conn_local.conns = {}
+    opened = conns.get(path)
+    if opened is not None and opened[0] == identity and opened[1] == generation:
+        return opened[2]
+    if opened is not None:
+        opened[2].close()
+    conn = connect_db(path, cached_statements=256)
+    conns[path] = (_file_identity(path), generation, conn)
+    return conn
+
+def _close_thread_conns() -> None:
+    """Close the calling thread's reused connections"""
+    conns = getattr(_conn_local, "conns", None) or {}
+    for _, _, conn in conns.values():
+        conn.close()
+    conns.clear()
+
+def close_connections() -> None:
+    """
+    Retire every reused helper connection; call before deleting or replacing a
+    database file. The caller's are closed now, other threads close theirs on
+    their next call.
+    """
+    global _conn_generation
+    with _conn_lock:
+        _conn_generation += 1
+    _close_thread_conns()
+
+atexit.register(_close_thread_conns)
+
 def random_date() -> str:
     start = datetime(2000, 1, 1)
     end   = datetime(2030, 12, 31)
@@ -64,57 +160,35 @@ def _try_parse_date(s: str) -> bool:
     except:
         return False
 
+_DATE_COLUMN = re.compile(r"date|_at$", re.IGNORECASE)
+
 def infer_sql_column_type_rule_list(
     values: List[Any], column_name: str, threshold: float = 0.8
 ) -> str:
     """
-    Use LLM to infer SQL column type based on column name and sample values.
-    Returns "REAL", "DATE", or "TEXT".
+    Infer SQL column type from the values: "REAL" / "DATE" when at least
+    `threshold` of the non-null values parse as numbers / ISO dates, else
+    "TEXT". A column with no values falls back on its name.
     """
-    try:
-        # Get a sample of values (up to 5) for context
-        sample_values = [str(v) for v in values if v is not None][:5]
-        sample_str = ", ".join(sample_values) if sample_values else "No values"
-
-        prompt = f"""
-        Given a column named '{column_name}' with sample values: [{sample_str}]
-        Determine the most appropriate SQL column type from these options:
-        - REAL: for numeric values, including money amounts
-        - DATE: for date values in any format
-        - TEXT: for any other type of data
-
-        Return ONLY one of these exact words: REAL, DATE, or TEXT
-        """
+    present = [str(v) for v in values if v is not None]
+    if not present:
+        return "DATE" if _DATE_COLUMN.search(column_name) else "TEXT"
+    if sum(map(_try_parse_float, present)) >= threshold * len(present):
+        return "REAL"
+    if sum(map(_try_parse_date, present)) >= threshold * len(present):
+        return "DATE"
+    return "TEXT"
 
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a SQL schema inference agent. Return only the type name."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        result = response.choices[0].message.content.strip().upper()
-        
-        # Validate the response is one of the expected types
-        if result not in ["REAL", "DATE", "TEXT"]:
-            print(f"[Warning] LLM returned unexpected type '{result}', defaulting to TEXT")
-            return "TEXT"
-            
-        return result
-
-    except Exception as e:
-        print(f"[Error] Type inference failed: {str(e)}, defaulting to TEXT")
-        return "TEXT"
+_NON_IDENT_CHAR = re.compile(r"\W")
 
+@lru_cache(maxsize=256)
 def sanitize_field_name(field_name: str) -> str:
     """
     Sanitize field name for SQLite by replacing spaces with underscores
     and ensuring it's a valid identifier.
     """
     # Replace spaces and special characters with underscores
-    sanitized = ''.join(c if c.isalnum() else '_' for c in field_name.strip().lower())
+    sanitized = _NON_IDENT_CHAR.sub('_', field_name.strip().lower())
     # Ensure it starts with a letter or underscore
     if not sanitized[0].isalpha() and sanitized[0] != '_':
         sanitized = '_' + sanitized
@@ -146,7 +220,7 @@ def store_records_sql(
         vals = [r[col] for r in records if r.get(col) is not None]
         schema[sanitized_col] = infer_sql_column_type_rule_list(vals, col)
 
-    conn = sqlite3.connect(db_path)
+    conn = _thread_conn(db_path)
     cur  = conn.cursor()
 
     # Add parent_field to schema if provided
@@ -167,8 +241,6 @@ def store_records_sql(
     for col, dtype in schema.items():
         sql_type = "REAL" if dtype == "REAL" else "TEXT"
         cols_ddl.append(f'"{col}" {sql_type}')
-    ddl = f'DROP TABLE IF EXISTS "{table_name}"; CREATE TABLE "{table_name}" ({", ".join(cols_ddl)});'
-    cur.executescript(ddl)
 
     # Bulk insert
     cols_list = [field_mapping[col] for col in sample.keys()]
@@ -176,39 +248,41 @@ def store_records_sql(
         cols_list.append('parent_field')
     if 'clause' not in cols_list:
         cols_list.append('clause')
-    placeholders = ", ".join("?" for _ in cols_list)
-    quoted_cols = ", ".join(f'"{col}"' for col in cols_list)
-    insert_sql = f'INSERT INTO "{table_name}" ({quoted_cols}) VALUES ({placeholders})'
-    
-    # Transform records to use sanitized column names
-    transformed_rows = []
-    for record in records:
-        row = []
-        for col in sample.keys():
-            row.append(record.get(col))
-        if parent_field:
-            row.append(record.get('parent_field'))
-        if 'clause' not in sample.keys():
-            row.append(record.get('clause'))
-        transformed_rows.append(row)
     
-    cur.executemany(insert_sql, transformed_rows)
-
-    conn.commit()
-    conn.close()
+    # Stage the values column by column; zip() then builds each row tuple
+    # lazily in C as the inserts consume them, with no N-row list in between
+    source_cols = list(sample.keys())
+    if parent_field:
+        source_cols.append('parent_field')
+    if 'clause' not in sample.keys():
+        source_cols.append('clause')
+    columns = [[record.get(col) for record in records] for col in source_cols]
+    n_rows = len(records)
+    rows = zip(*columns)
+    
+    # Drop, create and bulk insert in one explicit transaction: a single commit for the whole load
+    try:
+        cur.execute("BEGIN")
+        cur.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        # The clause full-text index would keep pointing at the old rowids
+        cur.execute(f'DROP TABLE IF EXISTS "{table_name}_fts"')
+        cur.execute(f'CREATE TABLE "{table_name}" ({", ".join(cols_ddl)})')
+        insert_rows(cur, table_name, cols_list, rows, n_rows)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
 
-    print(f"Stored {len(transformed_rows)} rows into '{table_name}' with schema: {schema}")
+    print(f"Stored {n_rows} rows into '{table_name}' with schema: {schema}")
     return schema
 
 def load_records(db_path: str, table_name: str) -> List[Dict[str, Any]]:
     """Fetch all rows from a table as a list of dicts."""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(f"SELECT * FROM {table_name}")
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    cur = _thread_conn(db_path).execute(f"SELECT * FROM {table_name}")
+    columns = [d[0] for d in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
 
 def infer_schema_from_records(records: List[Dict[str, Any]]) -> Dict[str, str]:
     """Re-infer schema by sampling existing table rows."""
@@ -220,6 +294,15 @@ def infer_schema_from_records(records: List[Dict[str, Any]]) -> Dict[str, str]:
         schema[col] = infer_sql_column_type_rule_list(vals, col)
     return schema
 
+def read_schema(db_path: str, table_name: str) -> Dict[str, str]:
+    """Column -> declared type from SQLite metadata; no row scan, no LLM calls."""
+    rows = _thread_conn(db_path).execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    return {row[1]: (row[2] or "TEXT") for row in rows}
+
+def count_records(db_path: str, table_name: str) -> int:
+    """Number of rows in a table."""
+    return _thread_conn(db_path).execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+
 def get_schema_description_list(schema: Dict[str, str]) -> str:
     """Build the plain-language schema description for prompts."""
     parts = []
@@ -237,13 +320,10 @@ def get_schema_description_list(schema: Dict[str, str]) -> str:
 # -------------------------
 # Agent 3: Field Extraction Agent
 # -------------------------
-def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]:
-    """
-    Extract specified fields from a clause using an LLM.
-    """
-    try:
-        fields_str = ", ".join(f'"{f}"' for f in fields)
-        prompt = f"""
+def extraction_request_body(clause: str, fields: List[str]) -> Dict[str, Any]:
+    """Chat-completions request for extracting `fields` from one clause (shared by the live and batch paths)"""
+    fields_str = ", ".join(f'"{f}"' for f in fields)
+    prompt = f"""
         Extract the following fields from the clause below: {fields_str}
         
         Clause: "{clause}"
@@ -252,39 +332,108 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
         - If a field is not present, the value should be null.
         - If a date is found, format it as YYYY-MM-DD.
         """
-        
+    return {
+        "model": "gpt-4o",
+        "response_format": {"type": "json_object"},
+        "messages": [
+            {"role": "system", "content": "You are a field extraction agent. Return only JSON."},
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]:
+    """
+    Extract specified fields from a clause using an LLM.
+    """
+    key = llm_cache.cache_key("gpt-4o", "free_query_v3.extract_fields_from_clause", clause, fields)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
         client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are a field extraction agent. Return only JSON."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        response = client.chat.completions.create(**extraction_request_body(clause, fields))
         
-        extracted_data = json.loads(response.choices[0].message.content)
+        extracted_data = orjson.loads(response.choices[0].message.content)
         
         # Add the original clause to the output
         extracted_data['clause'] = clause
+        llm_cache.put(key, extracted_data)
         return extracted_data
 
     except Exception as e:
         print(f"Field extraction failed for clause: {clause[:50]}... Error: {str(e)}")
         return {"clause": clause}
 
+def submit_batch_extraction(clauses: List[str], fields: List[str]) -> List[Dict[str, Any]]:
+    """
+    extract_fields_from_clause for many clauses through the OpenAI Batch API
+    (half the price, server-side scheduling instead of client rate limits,
+    completes within 24h). Blocks until the batch finishes. Clauses already
+    in the LLM cache are not resubmitted; clauses the batch fails on come
+    back as {"clause": clause}, like a failed live extraction.
+    """
+    keys = [llm_cache.cache_key("gpt-4o", "free_query_v3.extract_fields_from_clause", c, fields) for c in clauses]
+    records = [llm_cache.get(key) for key in keys]
+    pending = [i for i, record in enumerate(records) if record is None]
+    if pending:
+        client = get_openai_client()
+        lines = b"\n".join(
+            orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": extraction_request_body(clauses[i], fields),
+            })
+            for i in pending
+        )
+        batch_file = client.files.create(file=("extraction.jsonl", lines), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+        )
+        print(f"Submitted batch {batch.id} with {len(pending)} extraction requests")
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_POLL_SECONDS)
+            batch = client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            print(f"Batch {batch.id}: {batch.status} ({counts.completed}/{counts.total} done)" if counts else f"Batch {batch.id}: {batch.status}")
+
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).text.splitlines():
+                item = orjson.loads(line)
+                i = int(item["custom_id"])
+                try:
+                    extracted_data = orjson.loads(item["response"]["body"]["choices"][0]["message"]["content"])
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    print(f"Field extraction failed for clause: {clauses[i][:50]}... Error: {str(e)}")
+                    continue
+                extracted_data['clause'] = clauses[i]
+                llm_cache.put(keys[i], extracted_data)
+                records[i] = extracted_data
+        else:
+            print(f"[Error] Batch {batch.id} ended as '{batch.status}' without output")
+
+    return [record if record is not None else {"clause": c} for record, c in zip(records, clauses)]
+
 # -------------------------
 # Step 1: Construct DB from LEDGAR
 # -------------------------
-def construct_db_from_ledgar() -> (List[str], Dict[str, str]):
+@lru_cache(maxsize=1)
+def load_ledgar_provisions(path: str, limit: int, mtime: Optional[float] = None) -> tuple:
+    """First `limit` LEDGAR provisions, decoded once per process (mtime keys out a rewritten file)"""
+    with open(path, "rb") as f:
+        return tuple(orjson.loads(line)["provision"] for line in islice(f, limit))
+
+def construct_db_from_ledgar(use_batch: Optional[bool] = None) -> (List[str], Dict[str, str]):
     """
     Load clauses from the LEDGAR JSONL file, extract initial fields,
-    and store them in a new SQLite database.
+    and store them in a new SQLite database. Extraction goes through the
+    Batch API when `use_batch` is set, or by default when there are more
+    than BATCH_THRESHOLD clauses.
     """
     print(f"Constructing database from '{LEDGAR_PATH}'...")
-    with open(LEDGAR_PATH, "r") as f:
-        # Load raw clauses from the JSONL file
-        raw = [json.loads(line)["provision"] for line in f][:CLAUSE_LIMIT]
+    # Raw clauses from the JSONL file: only the first CLAUSE_LIMIT lines, parsed once per process
+    raw = load_ledgar_provisions(LEDGAR_PATH, CLAUSE_LIMIT, os.path.getmtime(LEDGAR_PATH))
 
     # Add a random date to each clause for testing date functionality
     clauses = [
@@ -293,8 +442,18 @@ def construct_db_from_ledgar() -> (List[str], Dict[str, str]):
     ]
 
     base_fields = ['company']
-    records = [extract_fields_from_clause(c, base_fields) for c in tqdm(clauses)]
+    if use_batch is None:
+        use_batch = len(clauses) > BATCH_THRESHOLD
+    if use_batch:
+        records = submit_batch_extraction(clauses, base_fields)
+    else:
+        # Clauses are independent: run up to LLM_CONCURRENCY extraction calls at once
+        records = list(tqdm(
+            _llm_pool.map(lambda c: extract_fields_from_clause(c, base_fields), clauses), total=len(clauses)
+        ))
     schema  = store_records_sql(records, SQL_DB_PATH, TABLE_NAME)
+    create_field_indexes(SQL_DB_PATH, TABLE_NAME, base_fields)
+    create_clause_fts(SQL_DB_PATH, TABLE_NAME, rebuild=True)
     return base_fields, schema
 
 # -------------------------
@@ -305,45 +464,69 @@ def decide_query_type(query: str, known_fields: List[str]) -> str:
     Decide if the query is a "hit" (can be answered by existing fields)
     or a "miss" (requires extracting new fields).
     """
-    try:
-        # Create a prompt that asks the model to classify the query
-        known_fields_str = ", ".join(known_fields)
-        prompt = f"""
-        Given the available fields: [{known_fields_str}]
-        
-        Classify the following user query as either a "hit" or a "miss".
-        - A "hit" means the query can be answered using only the available fields.
-        - A "miss" means the query requires extracting new information not covered by the available fields.
-        
-        Query: "{query}"
-        
-        Return ONLY the word "hit" or "miss".
-        """
-        
-        # Use a less powerful model for this simpler task
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a query classification agent."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        # The result should be either "hit" or "miss"
-        result = response.choices[0].message.content.strip().lower()
-        
-        # Basic validation
-        if result not in ["hit", "miss"]:
-            print(f"[Warning] Unexpected classification: {result}, defaulting to 'miss'")
-            return "miss"
-            
-        return result
+    # Nothing extracted yet: every query is a miss, no need to ask the LLM
+    if not known_fields:
+        return "miss"
 
+    # A query naming an extracted field is a hit; only ambiguous queries need embeddings
+    if mentions_known_field(query, known_fields):
+        return "hit"
+
+    try:
+        return _classify_query(query, tuple(sorted(known_fields)))
     except Exception as e:
         print(f"[Error] Query classification failed: {str(e)}, defaulting to 'miss'")
         return "miss"
 
+# Words that may sit next to a field name without changing what it refers to;
+# any other neighbour ("black company percentage") may qualify the field into a
+# different one, so the query goes to the classifier instead
+_FIELD_NEIGHBOURS = frozenset("""
+    a an the all any each every no not of for with without by in on at to from
+    and or is are was were be has have had that which who whose where what when
+    whether than then its their this these those show list find get give return
+    me contracts contract agreements agreement clauses clause provisions provision
+    over under above below more less before after between equal equals greater
+""".split())
+
+def mentions_known_field(query: str, known_fields: List[str]) -> bool:
+    """
+    True if the query names a known field as a whole phrase (as written or with
+    underscores as spaces) whose neighbouring words are only function words
+    """
+    words = re.findall(r"[a-z0-9_]+", query.lower())
+    text = " ".join(words)
+    for field in known_fields:
+        for name in {field.lower(), field.lower().replace("_", " ")}:
+            for m in re.finditer(rf"(?:^| ){re.escape(name)}(?= |$)", text):
+                before = text[:m.start()].split()
+                after = text[m.end():].split()
+                if (not before or before[-1] in _FIELD_NEIGHBOURS) and (not after or after[0] in _FIELD_NEIGHBOURS):
+                    return True
+    return False
+
+# Cosine similarity between a query and a field name above which the query counts as a hit
+QUERY_HIT_SIMILARITY = 0.72
+
+@lru_cache(maxsize=32)
+def _field_embeddings(known_fields: tuple):
+    """L2-normalized (K, dim) matrix of the known fields' embeddings, one row per field"""
+    import numpy as np
+    matrix = np.asarray(embed_texts([f.replace("_", " ") for f in known_fields]), dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+@lru_cache(maxsize=1024)
+def _classify_query(query: str, known_fields: tuple) -> str:
+    """
+    Embedding classification: a "hit" if the query is close to any known field.
+    One (cached) embedding per query instead of a chat completion; raises on
+    failure so fallbacks are never cached.
+    """
+    import numpy as np
+    vector = np.asarray(embed_texts([query])[0], dtype=np.float32)
+    best = float(np.max(_field_embeddings(known_fields) @ vector) / np.linalg.norm(vector))
+    return "hit" if best > QUERY_HIT_SIMILARITY else "miss"
+
 
 # -------------------------
 # Agent 4: SQL Generation Agent
@@ -357,58 +540,149 @@ def generate_filter_sql(
     Given a query and a db schema, use an LLM to generate a SQL WHERE clause.
     """
     try:
-        schema_desc = get_schema_description_list(schema)
-        prompt = f"""
-        Given the database schema:
-        - Table name: {table_name}
-        - Columns: {schema_desc}
-        
-        Generate a SQL WHERE clause for the following user query.
-        - Query: "{query}"
-        - The clause should be syntactically correct for SQLite.
-        - Do NOT include the "WHERE" keyword itself.
-        - If a column is of type REAL, you may need to CAST it for comparison.
-        - Return ONLY the SQL condition, without any markdown formatting, code blocks, or backticks.
-        - Do NOT wrap the response in ```sql``` or any other formatting.
-        
-        IMPORTANT GUIDELINES:
-        1. If the query is asking for content within clauses (like "clauses that contain X"), search within the 'clause' column using LIKE patterns
-        2. Use LIKE '%keyword%' for text searches within clause content
-        3. For queries about small companies, search for terms like 'small', 'SME', 'small to medium', 'small-sized' in the clause text
-        4. If a specific field exists but might be empty, also search the clause text as a fallback
-        5. Use OR conditions to search multiple related terms
-        6. For duration/term queries, search for 'duration', 'term', 'period', 'months', 'years' in clause text
-        7. For payment queries, search for 'payment', 'pay', 'fee', 'compensation', 'payable' in clause text
-        
-        Examples:
-        - "Show amounts over 1000": CAST(amount AS REAL) > 1000
-        - "Find clauses about small companies": clause LIKE '%small%' OR clause LIKE '%SME%' OR clause LIKE '%small to medium%'
-        - "What clauses mention termination": clause LIKE '%termination%' OR clause LIKE '%terminate%'
-        - "Find agreement duration": clause LIKE '%duration%' OR clause LIKE '%term%' OR clause LIKE '%period%' OR clause LIKE '%months%' OR clause LIKE '%years%'
-        - "Find payment terms": clause LIKE '%payment%' OR clause LIKE '%pay%' OR clause LIKE '%fee%' OR clause LIKE '%compensation%' OR clause LIKE '%payable%'
-        """
-        
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a SQL generation agent for SQLite. Generate appropriate WHERE conditions for content searches. Return only the SQL condition without any formatting."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        result = response.choices[0].message.content.strip()
-        
-        # Clean up any remaining markdown formatting
-        result = result.replace('```sql', '').replace('```', '').strip()
-        
-        return result
-        
+        return resolve_where(query, tuple(sorted(schema.items())), table_name)
     except Exception as e:
         print(f"SQL generation failed: {str(e)}")
         return "1=0" # Return a condition that returns no results
 
-def execute_generated_sql(sql_code: str, db_path: str):
+@lru_cache(maxsize=64)
+def build_sql_system_prompt(schema_items: tuple, table_name: str) -> str:
+    """
+    Everything in the SQL generation prompt except the query itself, built
+    once per schema. Queries against the same schema then share an identical
+    leading message, which OpenAI's automatic prompt caching reuses.
+    """
+    schema_desc = get_schema_description_list(dict(schema_items))
+    return f"""You are a SQL generation agent for SQLite. Generate appropriate WHERE conditions for content searches. Return only the SQL condition without any formatting.
+
+    Given the database schema:
+    - Table name: {table_name}
+    - Columns: {schema_desc}
+    
+    Generate a SQL WHERE clause for the user query.
+    - The clause should be syntactically correct for SQLite.
+    - Do NOT include the "WHERE" keyword itself.
+    - If a column is of type REAL, you may need to CAST it for comparison.
+    - Return ONLY the SQL condition, without any markdown formatting, code blocks, or backticks.
+    - Do NOT wrap the response in ```sql``` or any other formatting.
+    
+    IMPORTANT GUIDELINES:
+    1. If the query is asking for content within clauses (like "clauses that contain X"), search within the 'clause' column using LIKE patterns
+    2. Use LIKE '%keyword%' for text searches within clause content
+    3. For queries about small companies, search for terms like 'small', 'SME', 'small to medium', 'small-sized' in the clause text
+    4. If a specific field exists but might be empty, also search the clause text as a fallback
+    5. Use OR conditions to search multiple related terms
+    6. For duration/term queries, search for 'duration', 'term', 'period', 'months', 'years' in clause text
+    7. For payment queries, search for 'payment', 'pay', 'fee', 'compensation', 'payable' in clause text
+    
+    Examples:
+    - "Show amounts over 1000": CAST(amount AS REAL) > 1000
+    - "Find clauses about small companies": clause LIKE '%small%' OR clause LIKE '%SME%' OR clause LIKE '%small to medium%'
+    - "What clauses mention termination": clause LIKE '%termination%' OR clause LIKE '%terminate%'
+    - "Find agreement duration": clause LIKE '%duration%' OR clause LIKE '%term%' OR clause LIKE '%period%' OR clause LIKE '%months%' OR clause LIKE '%years%'
+    - "Find payment terms": clause LIKE '%payment%' OR clause LIKE '%pay%' OR clause LIKE '%fee%' OR clause LIKE '%compensation%' OR clause LIKE '%payable%'
+    """
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embedding vectors for `texts`, in order; each text's vector is persisted in llm_cache and fetched once"""
+    keys = [llm_cache.cache_key(EMBEDDING_MODEL, "free_query_v3.embed_texts", t) for t in texts]
+    vectors = [llm_cache.get(key) for key in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+        response = get_openai_client().embeddings.create(
+            model=EMBEDDING_MODEL, input=[texts[i] for i in missing]
+        )
+        for i, item in zip(missing, response.data):
+            vectors[i] = item.embedding
+            llm_cache.put(keys[i], item.embedding)
+    return vectors
+
+@lru_cache(maxsize=1)
+def sql_semantic_cache():
+    """Process-wide query -> WHERE clause semantic cache (numpy is only imported once SQL is generated)"""
+    from embedding_cache import SemanticCache
+    return SemanticCache(embed_texts)
+
+# Numbers, quoted literals, names and direction/negation words in a query
+# ("fees over $3000", "governed by 'New York' law", "contracts with Acme",
+# "without a termination fee") must match exactly for a semantic hit: pairs such
+# as "before 2020" / "after 2020" or "Acme" / "Globex" embed almost identically
+_QUERY_NUMBERS = re.compile(r"\d[\d,.]*")
+_QUERY_QUOTED = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+_QUERY_PROPER = re.compile(r"(?<![.!?]\s)(?<!^)\b[A-Z][\w&'-]*")
+_QUERY_POLARITY = re.compile(
+    r"\b(?:not|no|without|with|except|excluding|before|after|over|under|above|below|"
+    r"more|less|greater|fewer|least|most|earlier|later|min|max|minimum|maximum)\b",
+    re.IGNORECASE,
+)
+
+def _semantic_scope(query: str, schema_items: tuple, table_name: str) -> tuple:
+    """Queries only share SQL semantically within one schema, numbers, literals, names and polarity words"""
+    polarity = tuple(w.lower() for w in _QUERY_POLARITY.findall(query))
+    quoted = tuple(a or b for a, b in _QUERY_QUOTED.findall(query))
+    proper = tuple(_QUERY_PROPER.findall(_QUERY_QUOTED.sub(" ", query.strip())))
+    return schema_items, table_name, tuple(_QUERY_NUMBERS.findall(query)), quoted, proper, polarity
+
+def resolve_where(query: str, schema_items: tuple, table_name: str) -> str:
+    """
+    WHERE clause for a query: an exact repeat is answered from llm_cache;
+    otherwise the SQL of a semantically equivalent query is reused before
+    asking the LLM. An approximate reuse is never stored under this query's
+    exact key. Raises on failure, so callers decide the fallback.
+    """
+    exact = _generate_where.peek(query, schema_items, table_name)
+    if exact is not None:
+        return exact
+
+    scope = _semantic_scope(query, schema_items, table_name)
+    semantic, vector = None, None
+    try:
+        semantic = sql_semantic_cache()
+        vector = semantic.embed(query)
+        cached = semantic.get(vector, scope)
+        if cached is not None:
+            print(f"[Cache] Reusing SQL of a semantically equivalent query for: {query}")
+            return cached
+    except Exception as e:
+        print(f"[Warning] Semantic cache lookup failed: {e}")
+
+    result = _generate_where(query, schema_items, table_name)
+    if vector is not None:
+        semantic.put(vector, scope, result)
+    return result
+
+@llm_cache.cached("gpt-4o", "free_query_v3.generate_filter_sql")
+def _generate_where(query: str, schema_items: tuple, table_name: str) -> str:
+    """LLM SQL generation behind the on-disk cache; raises on failure so fallbacks are never cached"""
+    client = get_openai_client()
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": build_sql_system_prompt(schema_items, table_name)},
+            {"role": "user", "content": f'Query: "{query}"'}
+        ]
+    )
+    
+    result = response.choices[0].message.content.strip()
+    
+    # Clean up any remaining markdown formatting
+    result = result.replace('```sql', '').replace('```', '').strip()
+    return result
+
+def generate_filter_sql_many(
+    queries: List[str],
+    schema: Dict[str, str],
+    table_name: str = TABLE_NAME
+) -> List[str]:
+    """
+    generate_filter_sql for several queries at once, up to LLM_CONCURRENCY in
+    flight; results come back in the order of `queries`.
+    """
+    return list(_llm_pool.map(lambda q: generate_filter_sql(q, schema, table_name), queries))
+
+@lru_cache(maxsize=128)
+def clean_generated_sql(sql_code: str) -> str:
+    """Strip markdown fences, comments and quoting from LLM SQL; memoized since cached SQL text repeats"""
     sql = sql_code.strip()
     
     # Clean up the SQL query - remove markdown formatting
@@ -436,11 +710,14 @@ def execute_generated_sql(sql_code: str, db_path: str):
     
     # Additional cleaning for common markdown artifacts
     sql = sql.replace('```sql', '').replace('```', '')
-    sql = sql.strip()
+    return sql.strip()
+
+def execute_generated_sql(sql_code: str, db_path: str):
+    """Run the generated SQL; returns (column names, result rows)"""
+    sql = clean_generated_sql(sql_code)
     
     print(f"Executing SQL:\n{sql}\n")
-    conn = sqlite3.connect(db_path)
-    cur  = conn.cursor()
+    cur = _thread_conn(db_path).cursor()
     try:
         cur.execute(sql)
         rows = cur.fetchall()
@@ -464,7 +741,8 @@ def execute_generated_sql(sql_code: str, db_path: str):
             print(f"Fixed SQL also failed: {e2}")
             raise e2
     finally:
-        conn.close()
+        cur.close()
+    return cols, rows
 
 # Agent 2: New Field Discovery Agent
 # -------------------------
@@ -474,8 +752,21 @@ def decide_new_field(query: str, known_fields: List[str]) -> (str, Optional[str]
     Also, try to find a parent field to optimize processing.
     """
     try:
-        known_fields_str = ", ".join(known_fields)
-        prompt = f"""
+        new_field, parent_field = _discover_field(query, tuple(sorted(known_fields)))
+        return new_field, parent_field
+
+    except Exception as e:
+        print(f"Field discovery failed: {str(e)}")
+        # Fallback: create a simple field name from the query
+        new_field = "extracted_" + query.lower().replace(" ", "_")[:20]
+        return new_field, None
+
+@lru_cache(maxsize=1024)
+@llm_cache.cached("gpt-4o", "free_query_v3.decide_new_field")
+def _discover_field(query: str, known_fields: tuple) -> tuple:
+    """LLM field discovery behind the in-process and on-disk caches; raises on failure so fallbacks are never cached"""
+    known_fields_str = ", ".join(known_fields)
+    prompt = f"""
         A user query could not be answered with the available fields: [{known_fields_str}].
         
         User Query: "{query}"
@@ -490,31 +781,122 @@ def decide_new_field(query: str, known_fields: List[str]) -> (str, Optional[str]
         
         Return a JSON object with two keys: "new_field" and "parent_field".
         """
+    
+    client = get_openai_client()
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        response_format={"type": "json_object"},
+        messages=[
+            {"role": "system", "content": "You are a field discovery agent. Return only JSON."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    
+    data = orjson.loads(response.choices[0].message.content)
+    new_field = data.get("new_field")
+    parent_field = data.get("parent_field")
+    if not new_field:
+        raise ValueError(f"No new_field in response: {data}")
+    
+    if parent_field == "None" or parent_field not in known_fields:
+        parent_field = None
         
-        client = get_openai_client()
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": "You are a field discovery agent. Return only JSON."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        
-        data = json.loads(response.choices[0].message.content)
-        new_field = data.get("new_field")
-        parent_field = data.get("parent_field")
-        
-        if parent_field == "None" or parent_field not in known_fields:
-            parent_field = None
-            
-        return new_field, parent_field
+    return new_field, parent_field
+
+# Misses on tables of up to this many clauses name the new field and extract it in one LLM call
+FUSED_EXTRACTION_LIMIT = 20
+
+DECIDE_AND_EXTRACT_SCHEMA = {
+    "name": "decide_and_extract",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "new_field": {"type": "string"},
+            "parent_field": {"type": "string"},
+            "values": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "clause_id": {"type": "integer"},
+                        "value": {"type": ["string", "null"]},
+                    },
+                    "required": ["clause_id", "value"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["new_field", "parent_field", "values"],
+        "additionalProperties": False,
+    },
+}
 
+def decide_and_extract(
+    query: str,
+    known_fields: List[str],
+    clauses: List[str]
+) -> Optional[tuple]:
+    """
+    From a "miss" query, decide the new field (and its parent) and extract it
+    from every clause in a single structured-output call, instead of
+    decide_new_field followed by one extraction call per clause.
+    Returns (new_field, parent_field, values aligned with clauses), or None on
+    failure so the caller can fall back to the separate agents.
+    """
+    try:
+        new_field, parent_field, values = _decide_and_extract(query, tuple(sorted(known_fields)), tuple(clauses))
+        return new_field, parent_field, values
     except Exception as e:
-        print(f"Field discovery failed: {str(e)}")
-        # Fallback: create a simple field name from the query
-        new_field = "extracted_" + query.lower().replace(" ", "_")[:20]
-        return new_field, None
+        print(f"[Warning] Combined field discovery and extraction failed: {str(e)}, extracting per clause")
+        return None
+
+@lru_cache(maxsize=256)
+@llm_cache.cached("gpt-4o", "free_query_v3.decide_and_extract")
+def _decide_and_extract(query: str, known_fields: tuple, clauses: tuple) -> tuple:
+    """LLM discovery + extraction behind the in-process and on-disk caches; raises on failure so fallbacks are never cached"""
+    known_fields_str = ", ".join(known_fields)
+    clauses_str = "\n".join(f'[{i}] "{clause}"' for i, clause in enumerate(clauses))
+    prompt = f"""
+        A user query could not be answered with the available fields: [{known_fields_str}].
+        
+        User Query: "{query}"
+        
+        1. Decide the single most likely new field the user wants to extract.
+           - Name the field using snake_case (e.g., termination_fee, effective_date).
+           - If it is a sub-category of one of the available fields, that field is the "parent_field"; otherwise "None".
+        2. Extract that field from every numbered clause below, using the number as "clause_id".
+           - If the field is not present, the value should be null.
+           - If a date is found, format it as YYYY-MM-DD.
+        
+        Clauses:
+        {clauses_str}
+        """
+    
+    client = get_openai_client()
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        response_format={"type": "json_schema", "json_schema": DECIDE_AND_EXTRACT_SCHEMA},
+        messages=[
+            {"role": "system", "content": "You are a field discovery and extraction agent. Return only JSON."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    
+    data = orjson.loads(response.choices[0].message.content)
+    new_field = data.get("new_field")
+    parent_field = data.get("parent_field")
+    if not new_field:
+        raise ValueError(f"No new_field in response: {data}")
+    
+    if parent_field == "None" or parent_field not in known_fields:
+        parent_field = None
+    
+    values = [None] * len(clauses)
+    for item in data.get("values", []):
+        if 0 <= item["clause_id"] < len(clauses):
+            values[item["clause_id"]] = item["value"]
+    return new_field, parent_field, values
 
 def merge_new_fields_to_main_table(
     new_table_name: str,
@@ -526,7 +908,7 @@ def merge_new_fields_to_main_table(
     """
     Merge newly extracted fields back into the main table.
     """
-    conn = sqlite3.connect(db_path)
+    conn = _thread_conn(db_path)
     cur = conn.cursor()
 
     try:
@@ -567,6 +949,8 @@ def merge_new_fields_to_main_table(
             WHERE "{main_table}".clause = "{new_table_name}".clause
         )
         """
+        # The correlated lookups below match on clause text; index it so each is a probe, not a scan
+        cur.execute(f'CREATE INDEX IF NOT EXISTS "idx_{new_table_name}_clause" ON "{new_table_name}"(clause)')
         cur.execute(update_sql)
         conn.commit()
         print(f"Updated main table with values from {new_table_name}")
@@ -575,28 +959,176 @@ def merge_new_fields_to_main_table(
         print(f"Error merging fields: {e}")
         conn.rollback()
     finally:
-        conn.close()
+        cur.close()
+
+    create_field_indexes(db_path, main_table, [new_field, "parent_field"])
+
+def create_field_indexes(db_path: str, table_name: str, fields: List[str]) -> None:
+    """
+    Index the extracted fields so equality/range filters on them avoid a full
+    scan, then let SQLite refresh its planner statistics.
+    """
+    conn = _thread_conn(db_path)
+    try:
+        for field in fields:
+            col = sanitize_field_name(field)
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{col}" ON "{table_name}"("{col}")')
+        conn.commit()
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"[Warning] Index creation failed: {e}")
+
+def create_clause_fts(db_path: str, table_name: str = TABLE_NAME, rebuild: bool = False) -> bool:
+    """
+    Keep an FTS5 full-text index over the clause column: an external-content
+    table <table>_fts plus triggers that follow inserts, deletes and clause
+    updates. The index is (re)built when first created, when it no longer
+    matches the table (e.g. another writer recreated the table, which also
+    drops the triggers) or when `rebuild` is set. Returns False if this SQLite
+    build has no FTS5.
+    """
+    fts = f"{table_name}_fts"
+    conn = _thread_conn(db_path)
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone()
+        with conn:
+            conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS \"{fts}\" USING fts5(clause, content='{table_name}')")
+            conn.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "{fts}_ai" AFTER INSERT ON "{table_name}" BEGIN '
+                f'INSERT INTO "{fts}"(rowid, clause) VALUES (new.rowid, new.clause); END'
+            )
+            conn.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "{fts}_ad" AFTER DELETE ON "{table_name}" BEGIN '
+                f'INSERT INTO "{fts}"("{fts}", rowid, clause) VALUES (\'delete\', old.rowid, old.clause); END'
+            )
+            conn.execute(
+                f'CREATE TRIGGER IF NOT EXISTS "{fts}_au" AFTER UPDATE OF clause ON "{table_name}" BEGIN '
+                f'INSERT INTO "{fts}"("{fts}", rowid, clause) VALUES (\'delete\', old.rowid, old.clause); '
+                f'INSERT INTO "{fts}"(rowid, clause) VALUES (new.rowid, new.clause); END'
+            )
+            if rebuild or not exists or not _fts_in_sync(conn, fts):
+                conn.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')')
+        _fts_sync_state[(os.path.abspath(db_path), table_name)] = (_fts_version(conn, db_path), True)
+        return True
+    except sqlite3.Error as e:
+        print(f"[Warning] Full-text index unavailable: {e}")
+        return False
+
+# (db path, table) -> (version, in sync). The integrity-check reads the whole
+# index and table, so it runs once per schema change (e.g. a writer recreating
+# the table), not on every query; row changes are kept in sync by the triggers.
+_fts_sync_state: Dict[tuple, tuple] = {}
+
+def _fts_version(conn: sqlite3.Connection, db_path: str) -> tuple:
+    """Which database file, at which schema version, a sync check applies to"""
+    return os.stat(db_path).st_ino, conn.execute("PRAGMA schema_version").fetchone()[0]
+
+def _fts_in_sync(conn: sqlite3.Connection, fts: str) -> bool:
+    """
+    FTS5 integrity-check including the external-content table (rank = 1): it
+    fails when the index no longer matches the table's rowids and clauses.
+    """
+    try:
+        conn.execute(f'INSERT INTO "{fts}"("{fts}", rank) VALUES (\'integrity-check\', 1)')
+        return True
+    except sqlite3.DatabaseError:
+        return False
+
+def has_clause_fts(db_path: str, table_name: str = TABLE_NAME) -> bool:
+    """
+    Whether the full-text index from create_clause_fts exists and still matches
+    the table; callers fall back to plain LIKE otherwise, since a stale index
+    returns wrong rows without any error.
+    """
+    fts = f"{table_name}_fts"
+    key = (os.path.abspath(db_path), table_name)
+    conn = _thread_conn(db_path)
+    try:
+        version = _fts_version(conn, db_path)
+        known = _fts_sync_state.get(key)
+        if known is not None and known[0] == version:
+            return known[1]
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ).fetchone() is not None
+        in_sync = exists and _fts_in_sync(conn, fts)
+        _fts_sync_state[key] = (version, in_sync)
+        return in_sync
+    except sqlite3.Error:
+        return False
+    finally:
+        # The integrity-check is an INSERT: end its implicit transaction on this shared connection
+        if conn.in_transaction:
+            conn.rollback()
+
+_CLAUSE_LIKE = re.compile(r"""(?i)(?<![\w.])"?clause"?\s+LIKE\s+'%([^%_']+)%'""")
+
+def like_to_fts(where_clause: str, table_name: str = TABLE_NAME) -> str:
+    """
+    Rewrite `clause LIKE '%text%'` predicates into probes of the FTS5 index
+    built by create_clause_fts. The FTS form matches words starting with the
+    text rather than any substring, so "term" still finds "terminate" but no
+    longer matches inside "determine".
+    """
+    fts = f"{table_name}_fts"
 
-def handle_query(query: str, base_fields: List[str], schema: Dict[str, str]):
+    def to_match(m):
+        text = m.group(1).strip()
+        if not re.search(r"\w", text):
+            return m.group(0)
+        phrase = '"' + text.replace('"', '""') + '"*'
+        return f'rowid IN (SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH \'{phrase}\')'
+
+    return _CLAUSE_LIKE.sub(to_match, where_clause)
+
+def handle_query(
+    query: str,
+    base_fields: List[str],
+    schema: Dict[str, str],
+    classification: Optional[str] = None,
+    where_clause: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Main orchestrator for handling a user's query.
     This function coordinates all the agents to process the query.
+    A caller that already classified the query (and, for a hit, generated its
+    WHERE clause) passes them in so those agents are not asked again.
+    Returns {"schema": ..., "new_fields": [...], "columns": ..., "rows": ...}:
+    the (possibly extended) schema, the columns this call added to the main
+    table, and the result set.
     """
     print(f"\nHandling query: '{query}'")
+    original_columns = set(schema)
     
-    # Step 1: Decide query type
+    # Step 1: Decide query type. SQL is only generated once the query is known
+    # to be a hit, so a miss never pays for a WHERE clause it throws away.
     print("\nStep 1: Deciding query type (hit or miss)...")
-    classification = decide_query_type(query, base_fields)
+    if classification is None:
+        classification = decide_query_type(query, base_fields)
     print(f"Query classified as: {classification.upper()}")
     
     if classification == "miss":
-        # Step 2: Decide and extract new field
+        # Load clauses to process
+        clauses_to_process = load_records(SQL_DB_PATH, TABLE_NAME)
+
+        # Step 2: Decide and extract new field. A small table is handled by one
+        # combined call; otherwise (or if that fails) the field is decided first
+        # and then extracted clause by clause.
         print("\nStep 2: Deciding new field to extract...")
-        new_field, parent_field = decide_new_field(query, base_fields)
+        fused = None
+        if 0 < len(clauses_to_process) <= FUSED_EXTRACTION_LIMIT:
+            fused = decide_and_extract(query, base_fields, [r["clause"] for r in clauses_to_process])
+        if fused is not None:
+            new_field, parent_field, values = fused
+            for record, value in zip(clauses_to_process, values):
+                record[new_field] = value
+        else:
+            new_field, parent_field = decide_new_field(query, base_fields)
         print(f"New field to extract: '{new_field}' (Parent: {parent_field})")
         
-        # Load clauses to process
-        clauses_to_process = load_records(SQL_DB_PATH, TABLE_NAME)
         if parent_field:
             # Optimize by filtering clauses that have the parent field
             clauses_to_process = [
@@ -605,42 +1137,62 @@ def handle_query(query: str, base_fields: List[str], schema: Dict[str, str]):
             print(f"Optimized processing: {len(clauses_to_process)} clauses with parent field '{parent_field}'")
 
         # Step 3: Extract new field from clauses
-        print(f"\nStep 3: Extracting '{new_field}' from {len(clauses_to_process)} clauses...")
-        extracted_records = []
-        for record in tqdm(clauses_to_process):
-            extracted_data = extract_fields_from_clause(record["clause"], [new_field])
-            # Ensure the extracted data is a dictionary
-            if isinstance(extracted_data, dict):
-                record.update(extracted_data)
-            extracted_records.append(record)
+        if fused is not None:
+            print(f"\nStep 3: '{new_field}' was extracted from all clauses in Step 2")
+            extracted_records = clauses_to_process
+        else:
+            print(f"\nStep 3: Extracting '{new_field}' from {len(clauses_to_process)} clauses...")
+            extracted_records = []
+            # Clauses are independent: run up to LLM_CONCURRENCY extraction calls at once
+            extracted = _llm_pool.map(
+                lambda record: extract_fields_from_clause(record["clause"], [new_field]), clauses_to_process
+            )
+            for record, extracted_data in tqdm(zip(clauses_to_process, extracted), total=len(clauses_to_process)):
+                # Ensure the extracted data is a dictionary
+                if isinstance(extracted_data, dict):
+                    record.update(extracted_data)
+                extracted_records.append(record)
         
         # Step 4: Merge new field into main table
         print(f"\nStep 4: Merging new field '{new_field}' into main table...")
         if extracted_records:
             # Create a temporary table with the new data
             temp_table_name = f"temp_{sanitize_field_name(new_field)}"
-            store_records_sql(extracted_records, SQL_DB_PATH, temp_table_name)
+            temp_schema = store_records_sql(extracted_records, SQL_DB_PATH, temp_table_name)
             
             # Merge the temporary table into the main table
             merge_new_fields_to_main_table(
                 temp_table_name, new_field, parent_field, SQL_DB_PATH, TABLE_NAME
             )
             
-            # Update schema for SQL generation
-            recs = load_records(SQL_DB_PATH, TABLE_NAME)
-            schema = infer_schema_from_records(recs)
+            # Update schema for SQL generation: only the merged columns are new,
+            # and store_records_sql already inferred their types
+            merged = {sanitize_field_name(new_field), "parent_field"}
+            schema = {**schema, **{col: t for col, t in temp_schema.items() if col in merged and col not in schema}}
         
     # Step 5: Generate and execute SQL
     print("\nStep 5: Generating and executing SQL query…")
-    where_clause = generate_filter_sql(query, schema, TABLE_NAME)
+    if classification == "hit" and where_clause is not None:
+        print("Using the WHERE clause generated by the caller")
+    else:
+        where_clause = generate_filter_sql(query, schema, TABLE_NAME)
     
-    # Construct the full query
+    # Construct the full query; content searches probe the full-text index instead of scanning with LIKE
     sql_query = f"SELECT * FROM {TABLE_NAME}"
     if where_clause and where_clause.strip() and where_clause != "1=0":
+        if has_clause_fts(SQL_DB_PATH, TABLE_NAME):
+            where_clause = like_to_fts(where_clause, TABLE_NAME)
         sql_query += f" WHERE {where_clause}"
     
     print(f"\nExecuting SQL: {sql_query}")
-    execute_generated_sql(sql_query, SQL_DB_PATH)
+    cols, rows = execute_generated_sql(sql_query, SQL_DB_PATH)
+    
+    return {
+        "schema": schema,
+        "new_fields": [col for col in schema if col not in original_columns],
+        "columns": cols,
+        "rows": rows,
+    }
 
 def run_tests():
     """
@@ -651,6 +1203,7 @@ def run_tests():
     # Test 1: Initialize database with test data
     print("Test 1: Initializing database with test data...")
     if os.path.exists(SQL_DB_PATH):
+        close_connections()
         os.remove(SQL_DB_PATH)
     
     # Add some test data to the clauses
@@ -698,8 +1251,7 @@ def run_tests():
     # Test 4: Test field persistence
     print("\nTest 4: Testing field persistence...")
     # Load the database again to verify persistence
-    recs = load_records(SQL_DB_PATH, TABLE_NAME)
-    schema = infer_schema_from_records(recs)
+    schema = read_schema(SQL_DB_PATH, TABLE_NAME)
     base_fields = [col for col in schema if col != "clause"]
     
     print("\nPersisted fields in database:")
@@ -718,8 +1270,7 @@ if __name__ == "__main__":
         base_fields, schema = construct_db_from_ledgar()
     else:
         print("Database exists, loading schema & fields…")
-        recs = load_records(SQL_DB_PATH, TABLE_NAME)
-        schema = infer_schema_from_records(recs)
+        schema = read_schema(SQL_DB_PATH, TABLE_NAME)
         base_fields = [col for col in schema if col != "clause"]
 
     print("\nAvailable fields in the database:")
@@ -0,0 +1,21 @@
+"""
+Shared HTTP transport for the OpenAI clients.
+
+Every module's client sends its requests through one keep-alive connection
+pool (HTTP/2 when the h2 package is installed) instead of paying a new TLS
+handshake per request.
+"""
+import importlib.util
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def pooled_http_client():
+    """httpx client to pass as OpenAI(http_client=...), built once per process"""
+    # Imported here so importing this module stays free for SQL-only callers
+    import httpx
+    from openai import DefaultHttpxClient
+    return DefaultHttpxClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
@@ -0,0 +1,81 @@
+"""
+Persistent on-disk cache for LLM responses.
+
+Extraction, classification and SQL generation are idempotent for a given
+model, prompt inputs and clause, so their parsed responses are stored in a
+small SQLite sidecar (LLM_CACHE_PATH) and reused across runs, processes and
+Streamlit sessions instead of paying for another round trip.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from functools import wraps
+from typing import Any, Optional
+
+import orjson
+
+LLM_CACHE_PATH = "llm_cache.db"
+
+_local = threading.local()
+
+
+def cache_key(model: str, name: str, *args) -> str:
+    """Stable key for one LLM call: the model, the calling agent's name and its (JSON-serializable) inputs"""
+    payload = json.dumps([model, name, *args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _conn() -> sqlite3.Connection:
+    """One connection per thread, so callers running on a thread pool never share a cursor"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(LLM_CACHE_PATH, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS llm_cache(key TEXT PRIMARY KEY, response TEXT)")
+        _local.conn = conn
+    return conn
+
+
+def get(key: str) -> Optional[Any]:
+    """Parsed response stored under `key`, or None if the call was never cached"""
+    try:
+        row = _conn().execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error as e:
+        print(f"[Warning] LLM cache read failed: {e}")
+        return None
+    return orjson.loads(row[0]) if row else None
+
+
+def put(key: str, value: Any) -> None:
+    """Store a parsed response; only call this for answers worth replaying (never error fallbacks)"""
+    if value is None:
+        return
+    try:
+        _conn().execute(
+            "INSERT OR REPLACE INTO llm_cache(key, response) VALUES (?, ?)", (key, orjson.dumps(value).decode())
+        )
+    except sqlite3.Error as e:
+        print(f"[Warning] LLM cache write failed: {e}")
+
+
+def cached(model: str, name: str):
+    """
+    Decorator for LLM-backed functions that raise on failure: results are
+    replayed from the cache on a hit, and only successful results are stored.
+    `fn.peek(*args)` returns the cached result, or None, without calling fn.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = cache_key(model, name, args, kwargs)
+            hit = get(key)
+            if hit is not None:
+                return hit
+            result = fn(*args, **kwargs)
+            put(key, result)
+            return result
+        wrapper.peek = lambda *args, **kwargs: get(cache_key(model, name, args, kwargs))
+        return wrapper
+    return decorator
@@ -1,5 +1,8 @@
 import json
 import sqlite3
+
+import orjson
+
 from query_processor import extract_fields_from_clause, store_records_sql
 
 JSONL_PATH = "synthetic_clauses.jsonl"
@@ -37,11 +40,9 @@ def clean_record(record):
 
 def main():
     # Load clauses from JSONL
-    clauses = []
-    with open(JSONL_PATH, 'r') as f:
-        for line in f:
-            data = json.loads(line)
-            clauses.append(data['provision'])
+    # Decode line by line straight from bytes; only the provision strings are kept
+    with open(JSONL_PATH, 'rb') as f:
+        clauses = [orjson.loads(line)['provision'] for line in f]
     
     print(f"Loaded {len(clauses)} clauses from JSONL")
     
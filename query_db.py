@@ -2,8 +2,12 @@ import json
 import os
 import sqlite3
 from typing import Dict, Any, List, Optional
+
+import orjson
 from openai import OpenAI
 
+from sql_utils import SQL_FENCE
+
 # Try to import streamlit for secrets, fallback to environment variable
 try:
     import streamlit as st
@@ -27,12 +31,9 @@ def load_clauses_from_jsonl() -> List[str]:
     if not os.path.exists(JSONL_PATH):
         raise FileNotFoundError(f"JSONL file {JSONL_PATH} not found. Please run synthesize_db.py first.")
     
-    clauses = []
-    with open(JSONL_PATH, 'r') as f:
-        for line in f:
-            data = json.loads(line)
-            clauses.append(data['provision'])
-    return clauses
+    # Decode line by line straight from bytes; only the provision strings are kept
+    with open(JSONL_PATH, 'rb') as f:
+        return [orjson.loads(line)['provision'] for line in f]
 
 def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]:
     """Extract specified fields from a clause using LLM."""
@@ -97,7 +98,11 @@ def store_records_sql(records: List[Dict[str, Any]], db_path: str, table_name: s
     for col, dtype in schema.items():
         cols_ddl.append(f'"{col}" {dtype}')
     
-    ddl = f'DROP TABLE IF EXISTS "{table_name}"; CREATE TABLE "{table_name}" ({", ".join(cols_ddl)});'
+    # Also drop the clause full-text index, which would keep pointing at the old rowids
+    ddl = (
+        f'DROP TABLE IF EXISTS "{table_name}"; DROP TABLE IF EXISTS "{table_name}_fts"; '
+        f'CREATE TABLE "{table_name}" ({", ".join(cols_ddl)});'
+    )
     cur.executescript(ddl)
 
     # Insert records
@@ -174,7 +179,7 @@ def generate_filter_sql(query: str, schema: Dict[str, str]) -> str:
             ]
         )
         sql = resp.choices[0].message.content.strip()
-        sql = sql.replace("```sql", "").replace("```", "").strip().strip('"""')
+        sql = SQL_FENCE.sub("", sql).strip()
         
         # Find the field being queried
         field_name = None
@@ -5,8 +5,13 @@ import random
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+import orjson
 from openai import OpenAI
 
+import llm_cache
+from http_pool import pooled_http_client
+from sql_utils import SQL_FENCE, insert_rows
+
 # Global variable to hold the OpenAI client
 oai_client = None
 
@@ -17,11 +22,14 @@ def get_openai_client():
     if oai_client is not None:
         return oai_client
     
+    # One keep-alive connection pool (HTTP/2 when h2 is installed) for every call through this client
+    http_client = pooled_http_client()
+    
     try:
         import streamlit as st
         # For Streamlit Cloud deployment
         if "OPENAI_API_KEY" in st.secrets:
-            oai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+            oai_client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"], http_client=http_client)
             print("✅ OpenAI client initialized with Streamlit secrets")
             return oai_client
         else:
@@ -34,7 +42,7 @@ def get_openai_client():
         api_key = os.environ.get('OPENAI_API_KEY', 'your_api_key_here_for_local_testing')
         if api_key and api_key != 'your_api_key_here_for_local_testing':
             try:
-                oai_client = OpenAI(api_key=api_key)
+                oai_client = OpenAI(api_key=api_key, http_client=http_client)
                 print("✅ OpenAI client initialized with environment variable")
                 return oai_client
             except Exception as init_error:
@@ -140,6 +148,11 @@ def infer_sql_column_type(values: List[Any], column_name: str) -> str:
 
 def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]:
     """Extract specified fields from a clause using LLM."""
+    key = llm_cache.cache_key("gpt-4o-mini", "query_processor.extract_fields_from_clause", clause, fields)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         client = get_openai_client()  # Get client when needed
         
@@ -174,7 +187,7 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
             response_format={"type": "json_object"}
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = orjson.loads(response.choices[0].message.content)
         print(f"\nExtracted fields from clause:")
         print(json.dumps(result, indent=2))
         
@@ -205,6 +218,7 @@ def extract_fields_from_clause(clause: str, fields: List[str]) -> Dict[str, Any]
                         pass
         
         result['clause'] = clause
+        llm_cache.put(key, result)
         return result
         
     except Exception as e:
@@ -267,6 +281,10 @@ def store_records_sql(records: List[Dict[str, Any]], db_path: str, table_name: s
 
     # Create table
     conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
     cur = conn.cursor()
 
     cols_ddl = []
@@ -274,8 +292,6 @@ def store_records_sql(records: List[Dict[str, Any]], db_path: str, table_name: s
         sql_type = "REAL" if dtype == "REAL" else "TEXT"
         cols_ddl.append(f'"{col}" {sql_type}')
     
-    ddl = f'DROP TABLE IF EXISTS "{table_name}"; CREATE TABLE "{table_name}" ({", ".join(cols_ddl)});'
-    cur.executescript(ddl)
 
     # Insert records
     cols_list = [field_mapping[col] for col in sample.keys()]
@@ -284,10 +300,6 @@ def store_records_sql(records: List[Dict[str, Any]], db_path: str, table_name: s
     if 'clause' not in cols_list:
         cols_list.append('clause')
     
-    placeholders = ", ".join("?" for _ in cols_list)
-    quoted_cols = ", ".join(f'"{col}"' for col in cols_list)
-    insert_sql = f'INSERT INTO "{table_name}" ({quoted_cols}) VALUES ({placeholders})'
-    
     transformed_rows = []
     for record in records:
         row = []
@@ -299,16 +311,56 @@ def store_records_sql(records: List[Dict[str, Any]], db_path: str, table_name: s
             row.append(record.get('clause'))
         transformed_rows.append(row)
     
-    cur.executemany(insert_sql, transformed_rows)
-    conn.commit()
-    conn.close()
+    # Drop, create and bulk insert in one explicit transaction: a single commit for the whole load
+    try:
+        cur.execute("BEGIN")
+        cur.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        # The clause full-text index would keep pointing at the old rowids
+        cur.execute(f'DROP TABLE IF EXISTS "{table_name}_fts"')
+        cur.execute(f'CREATE TABLE "{table_name}" ({", ".join(cols_ddl)})')
+        insert_rows(cur, table_name, cols_list, transformed_rows, len(transformed_rows))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
     print(f"\nStored {len(transformed_rows)} rows with schema:")
     print(json.dumps(schema, indent=2))
     return schema
 
+def create_schema_indexes(db_path: str, table_name: str, schema: Dict[str, str]) -> None:
+    """Index every extracted column (REAL ones also as CAST(... AS REAL), the form generated filters use) and refresh planner statistics."""
+    conn = sqlite3.connect(db_path)
+    try:
+        for col, dtype in schema.items():
+            if col == "clause":
+                continue
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{col}" ON "{table_name}"("{col}")')
+            if dtype == "REAL":
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{col}_real" ON "{table_name}"(CAST("{col}" AS REAL))'
+                )
+        conn.commit()
+        conn.execute("ANALYZE")
+    except sqlite3.Error as e:
+        print(f"[Warning] Index creation failed: {e}")
+    finally:
+        conn.close()
+
 def decide_query_type(query: str, known_fields: List[str]) -> str:
     """Determine if query is asking for known or new fields."""
+    # Naming a known field is a hit without asking the LLM
+    ql = query.lower()
+    if any(f.lower() in ql or f.lower().replace("_", " ") in ql for f in known_fields):
+        return "hit"
+
+    key = llm_cache.cache_key("gpt-4o-mini", "query_processor.decide_query_type", query, known_fields)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
         client = get_openai_client()  # Get client when needed
         
@@ -325,12 +377,20 @@ def decide_query_type(query: str, known_fields: List[str]) -> str:
             ]
         )
         decision = resp.choices[0].message.content.strip().lower()
-        return decision if decision in ("hit", "miss") else "hit"
+        if decision not in ("hit", "miss"):
+            return "hit"
+        llm_cache.put(key, decision)
+        return decision
     except:
         return "hit" if any(f.lower() in query.lower() for f in known_fields) else "miss"
 
 def decide_new_field(query: str, known_fields: List[str]) -> (str, Optional[str]):
     """Determine new field to extract and potential parent field."""
+    key = llm_cache.cache_key("gpt-4o-mini", "query_processor.decide_new_field", query, known_fields)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return tuple(cached)
+
     known_fields_str = ", ".join(known_fields) if known_fields else "None"
     prompt = f"""
 Given the query: '{query}'
@@ -350,7 +410,7 @@ Return your answer as a JSON object with two keys: "new_field" (string) and "par
             ],
             response_format={"type": "json_object"}
         )
-        result = json.loads(resp.choices[0].message.content)
+        result = orjson.loads(resp.choices[0].message.content)
         
         new_field = result.get("new_field")
         parent_field = result.get("parent_field")
@@ -362,6 +422,7 @@ Return your answer as a JSON object with two keys: "new_field" (string) and "par
         if isinstance(parent_field, str) and parent_field.lower() in ["none", "null", ""]:
             parent_field = None
             
+        llm_cache.put(key, [new_field, parent_field])
         return new_field, parent_field
         
     except Exception as e:
@@ -371,6 +432,11 @@ Return your answer as a JSON object with two keys: "new_field" (string) and "par
 
 def generate_filter_sql(query: str, schema: Dict[str, str], table_name: str = TABLE_NAME) -> str:
     """Generate SQL query based on natural language query and schema."""
+    key = llm_cache.cache_key("gpt-4o-mini", "query_processor.generate_filter_sql", query, schema, table_name)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+
     schema_desc = ", ".join(f"{col} ({dtype})" for col, dtype in schema.items())
     prompt = f"""
     Given the SQL table structure: {schema_desc} and the query: '{query}'
@@ -378,7 +444,7 @@ def generate_filter_sql(query: str, schema: Dict[str, str], table_name: str = TA
     
     Rules:
     1. For numeric fields (REAL type):
-       - Use CAST(column AS REAL) for comparisons
+       - Values are already stored as numbers: compare the column directly, no CAST needed
        - Handle percentages as decimals (e.g., 0.1 for 10%)
        - Use >, <, >=, <=, = for numeric comparisons
        - Always exclude NULL values unless specifically requested
@@ -410,7 +476,7 @@ def generate_filter_sql(query: str, schema: Dict[str, str], table_name: str = TA
             ]
         )
         sql = resp.choices[0].message.content.strip()
-        sql = sql.replace("```sql", "").replace("```", "").strip().strip('"""')
+        sql = SQL_FENCE.sub("", sql).strip()
         
         # Find the field being queried
         field_name = None
@@ -434,6 +500,7 @@ def generate_filter_sql(query: str, schema: Dict[str, str], table_name: str = TA
             sql = sql.replace("FROM", f"FROM {table_name}")
             
         print(f"\nGenerated SQL query:\n{sql}")
+        llm_cache.put(key, sql)
         return sql
         
     except Exception as e:
@@ -444,7 +511,7 @@ def generate_filter_sql(query: str, schema: Dict[str, str], table_name: str = TA
 
 def execute_generated_sql(sql_code: str, db_path: str):
     """Execute generated SQL query and return results."""
-    sql = sql_code.replace("```sql", "").replace("```", "").strip().strip('"""')
+    sql = SQL_FENCE.sub("", sql_code).strip()
     print(f"\nExecuting SQL:\n{sql}\n")
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
@@ -538,7 +605,7 @@ def generate_synthetic_clauses(field: str, num_clauses: int = 10) -> List[str]:
             response_format={"type": "json_object"}
         )
         
-        clauses = json.loads(response.choices[0].message.content)
+        clauses = orjson.loads(response.choices[0].message.content)
         if isinstance(clauses, dict) and "clauses" in clauses:
             clauses = clauses["clauses"]
         elif not isinstance(clauses, list):
@@ -6,7 +6,7 @@ Tests SQL generation and direct query execution
 
 import sqlite3
 from free_query_v3 import (
-    generate_filter_sql, load_records, infer_schema_from_records, 
+    generate_filter_sql, count_records, read_schema, 
     SQL_DB_PATH, TABLE_NAME
 )
 
@@ -16,10 +16,10 @@ def test_core_queries():
     print("="*50)
     
     # Load database state
-    records = load_records(SQL_DB_PATH, TABLE_NAME)
-    schema = infer_schema_from_records(records)
+    record_count = count_records(SQL_DB_PATH, TABLE_NAME)
+    schema = read_schema(SQL_DB_PATH, TABLE_NAME)
     
-    print(f"Database: {len(records)} records")
+    print(f"Database: {record_count} records")
     print(f"Schema: {len(schema)} fields")
     
     # Test queries
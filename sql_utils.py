@@ -0,0 +1,32 @@
+"""
+SQLite helpers shared by the query modules.
+
+Kept free of any project imports so that free_query_v3 and query_processor
+can both depend on it without importing each other.
+"""
+import re
+import sqlite3
+from itertools import chain, islice
+from typing import List
+
+
+# Markdown fences / triple quotes the LLM sometimes wraps around generated SQL
+SQL_FENCE = re.compile(r'^\s*```(?:sql)?\s*|\s*```\s*$|^\s*"{3}|"{3}\s*$', re.IGNORECASE)
+
+
+def insert_rows(cur: sqlite3.Cursor, table_name: str, cols: List[str], rows, n_rows: int) -> None:
+    """
+    Insert `n_rows` rows (any iterable of value sequences, consumed once) into
+    `cols` of `table_name`. Several rows go into each INSERT statement, within
+    SQLite's classic 999 bound-parameter limit; the remainder that doesn't fill
+    a whole statement goes through executemany of the single-row form.
+    """
+    rows = iter(rows)
+    placeholders = ", ".join("?" for _ in cols)
+    quoted_cols = ", ".join(f'"{col}"' for col in cols)
+    insert_sql = f'INSERT INTO "{table_name}" ({quoted_cols}) VALUES '
+    rows_per_stmt = max(1, min(n_rows, 999 // len(cols)))
+    multi_insert_sql = insert_sql + ", ".join([f"({placeholders})"] * rows_per_stmt)
+    for _ in range(n_rows // rows_per_stmt):
+        cur.execute(multi_insert_sql, list(chain.from_iterable(islice(rows, rows_per_stmt))))
+    cur.executemany(insert_sql + f"({placeholders})", rows)
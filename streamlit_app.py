@@ -2,7 +2,7 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import json
-from query_processor import process_query
+from cached_ops import cached_process_query, get_conn
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -47,77 +47,88 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_database_stats():
+    """Run the statistics queries; cached so reruns skip the round trips"""
+    cur = get_conn('clauses.db').cursor()
+    
+    # Total clauses
+    cur.execute("SELECT COUNT(*) FROM clauses")
+    total_clauses = cur.fetchone()[0]
+    
+    # Companies with data
+    cur.execute("SELECT COUNT(DISTINCT company) FROM clauses WHERE company IS NOT NULL")
+    unique_companies = cur.fetchone()[0]
+    
+    # Amount statistics
+    cur.execute("SELECT MIN(amount), MAX(amount), AVG(amount) FROM clauses WHERE amount IS NOT NULL")
+    amount_stats = cur.fetchone()
+    
+    # Risk score statistics
+    cur.execute("SELECT MIN(risk_score), MAX(risk_score), AVG(risk_score) FROM clauses WHERE risk_score IS NOT NULL")
+    risk_stats = cur.fetchone()
+    
+    # Date range
+    cur.execute("SELECT MIN(effective_date), MAX(effective_date) FROM clauses WHERE effective_date IS NOT NULL")
+    date_range = cur.fetchone()
+    
+    return {
+        'total_clauses': total_clauses,
+        'unique_companies': unique_companies,
+        'amount_stats': amount_stats,
+        'risk_stats': risk_stats,
+        'date_range': date_range
+    }
+
 def get_database_stats():
     """Get statistics about the database"""
     try:
-        conn = sqlite3.connect('clauses.db')
-        cur = conn.cursor()
-        
-        # Total clauses
-        cur.execute("SELECT COUNT(*) FROM clauses")
-        total_clauses = cur.fetchone()[0]
-        
-        # Companies with data
-        cur.execute("SELECT COUNT(DISTINCT company) FROM clauses WHERE company IS NOT NULL")
-        unique_companies = cur.fetchone()[0]
-        
-        # Amount statistics
-        cur.execute("SELECT MIN(amount), MAX(amount), AVG(amount) FROM clauses WHERE amount IS NOT NULL")
-        amount_stats = cur.fetchone()
-        
-        # Risk score statistics
-        cur.execute("SELECT MIN(risk_score), MAX(risk_score), AVG(risk_score) FROM clauses WHERE risk_score IS NOT NULL")
-        risk_stats = cur.fetchone()
-        
-        # Date range
-        cur.execute("SELECT MIN(effective_date), MAX(effective_date) FROM clauses WHERE effective_date IS NOT NULL")
-        date_range = cur.fetchone()
-        
-        conn.close()
-        
-        return {
-            'total_clauses': total_clauses,
-            'unique_companies': unique_companies,
-            'amount_stats': amount_stats,
-            'risk_stats': risk_stats,
-            'date_range': date_range
-        }
+        return _load_database_stats()
     except Exception as e:
         st.error(f"Error getting database stats: {e}")
         return None
 
+def _read_frame(conn, sql):
+    """Run a query and build the DataFrame straight from the cursor rows"""
+    cur = conn.execute(sql)
+    cols = [d[0] for d in cur.description]
+    return pd.DataFrame.from_records(cur.fetchall(), columns=cols)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _load_sample_data():
+    """Run the visualization queries; cached so reruns skip the round trips"""
+    conn = get_conn('clauses.db')
+    
+    # Amount distribution
+    amount_df = _read_frame(conn, """
+        SELECT amount, company, risk_score 
+        FROM clauses 
+        WHERE amount IS NOT NULL 
+        ORDER BY amount DESC
+    """)
+    
+    # Risk score distribution
+    risk_df = _read_frame(conn, """
+        SELECT risk_score, risk_level, company 
+        FROM clauses 
+        WHERE risk_score IS NOT NULL
+    """)
+    
+    # Company distribution
+    company_df = _read_frame(conn, """
+        SELECT company, COUNT(*) as clause_count 
+        FROM clauses 
+        WHERE company IS NOT NULL 
+        GROUP BY company 
+        ORDER BY clause_count DESC
+    """)
+    
+    return amount_df, risk_df, company_df
+
 def get_sample_data():
     """Get sample data for visualization"""
     try:
-        conn = sqlite3.connect('clauses.db')
-        
-        # Amount distribution
-        amount_df = pd.read_sql_query("""
-            SELECT amount, company, risk_score 
-            FROM clauses 
-            WHERE amount IS NOT NULL 
-            ORDER BY amount DESC
-        """, conn)
-        
-        # Risk score distribution
-        risk_df = pd.read_sql_query("""
-            SELECT risk_score, risk_level, company 
-            FROM clauses 
-            WHERE risk_score IS NOT NULL
-        """, conn)
-        
-        # Company distribution
-        company_df = pd.read_sql_query("""
-            SELECT company, COUNT(*) as clause_count 
-            FROM clauses 
-            WHERE company IS NOT NULL 
-            GROUP BY company 
-            ORDER BY clause_count DESC
-        """, conn)
-        
-        conn.close()
-        
-        return amount_df, risk_df, company_df
+        return _load_sample_data()
     except Exception as e:
         st.error(f"Error getting sample data: {e}")
         return None, None, None
@@ -225,7 +236,7 @@ def main():
         if search_clicked and query_input:
             with st.spinner("Processing your query..."):
                 try:
-                    results = process_query(query_input)
+                    results = cached_process_query(query_input)
                     st.session_state.last_results = results
                     st.session_state.last_query = query_input
                 except Exception as e:
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from query_processor import process_query
 import json
 
@@ -38,8 +39,12 @@ def test_queries():
     print("\nTesting Query Processor...")
     print("Database should be loaded with sample data first")
     
-    for query in test_cases:
-        results = process_query(query)
+    # Each query is an independent LLM + SQLite round trip, so run them
+    # concurrently and print the results in the original order afterwards
+    with ThreadPoolExecutor(max_workers=min(8, len(test_cases))) as ex:
+        all_results = list(ex.map(process_query, test_cases))
+    
+    for query, results in zip(test_cases, all_results):
         print_results(query, results)
 
 if __name__ == "__main__":
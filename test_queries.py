@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Query accuracy tests driven by the comprehensive suite's TESTS table.
+
+Each case generates SQL through the live OpenAI API (skipped without
+OPENAI_API_KEY) and only reads the database, so the cases are independent and
+can be spread across processes:
+
+    pytest test_queries.py -n auto    # pytest-xdist, see requirements.txt
+"""
+
+import os
+import threading
+
+import pytest
+
+if not os.environ.get("OPENAI_API_KEY"):
+    pytest.skip("OPENAI_API_KEY not set; SQL generation needs the OpenAI API.", allow_module_level=True)
+
+import llm_cache
+from comprehensive_test import TESTS, find_keywords
+from free_query_v3 import (
+    connect_db, generate_filter_sql, has_clause_fts, like_to_fts, read_schema, SQL_DB_PATH, TABLE_NAME
+)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def scratch_llm_cache(tmp_path_factory):
+    """Keep LLM responses in a per-session scratch cache instead of writing the project's llm_cache.db"""
+    llm_cache.LLM_CACHE_PATH = str(tmp_path_factory.mktemp("llm_cache") / "llm_cache.db")
+    llm_cache._local = threading.local()
+    yield
+
+
+@pytest.fixture(scope="session")
+def shared_conn():
+    """One WAL-mode connection per test process"""
+    if not os.path.exists(SQL_DB_PATH):
+        pytest.skip("Database not found. Please run the system first.")
+    conn = connect_db(SQL_DB_PATH)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope="session")
+def schema(shared_conn):
+    return read_schema(SQL_DB_PATH, TABLE_NAME)
+
+
+@pytest.fixture(scope="session")
+def fts(shared_conn):
+    """Whether an up-to-date clause full-text index is available (tests never build it)"""
+    return has_clause_fts(SQL_DB_PATH, TABLE_NAME)
+
+
+@pytest.mark.parametrize("name,query,min_r,kws", TESTS, ids=[test[0] for test in TESTS])
+def test_query(name, query, min_r, kws, shared_conn, schema, fts):
+    where_clause = generate_filter_sql(query, schema, TABLE_NAME)
+    # "1=0" is generate_filter_sql's failure fallback; running it unfiltered would pass any case
+    if where_clause == "1=0":
+        pytest.fail(f"SQL generation failed for {query!r}")
+    if where_clause and where_clause.strip():
+        filter_sql = like_to_fts(where_clause, TABLE_NAME) if fts else where_clause
+        full_sql = f"SELECT * FROM {TABLE_NAME} WHERE {filter_sql}"
+    else:
+        full_sql = f"SELECT * FROM {TABLE_NAME}"
+
+    cur = shared_conn.execute(full_sql)
+    results = cur.fetchall()
+    columns = [description[0] for description in cur.description]
+
+    assert len(results) >= min_r, f"{full_sql}: {len(results)} results, expected >= {min_r}"
+    if kws and results:
+        assert find_keywords(results, columns, kws), f"{full_sql}: none of {kws} found in results"
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+SQL generation cache tests: the semantic cache may reuse SQL across
+equivalent queries, but never across antonyms, and an approximate reuse is
+never written to llm_cache as the new query's exact answer.
+
+Runs offline: the OpenAI client and the embeddings are faked.
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("numpy")
+
+import free_query_v3 as fq
+import llm_cache
+
+SCHEMA = {"clause": "TEXT", "effective_date": "DATE"}
+
+
+@pytest.fixture
+def llm_calls(monkeypatch, tmp_path):
+    """Fresh llm_cache and semantic cache, every text embedding to the same vector, and a fake SQL LLM"""
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_local", threading.local())
+    monkeypatch.setattr(fq, "embed_texts", lambda texts: [[1.0, 0.0] for _ in texts])
+    fq.sql_semantic_cache.cache_clear()
+
+    calls = []
+
+    def create(model, messages):
+        query = messages[-1]["content"]
+        calls.append(query)
+        op = "<" if "before" in query else ">"
+        message = SimpleNamespace(content=f"effective_date {op} '2020-01-01'")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(fq, "get_openai_client", lambda: client)
+    yield calls
+    fq.sql_semantic_cache.cache_clear()
+
+
+def test_antonyms_do_not_share_sql(llm_calls):
+    before = fq.generate_filter_sql("contracts effective before 2020", SCHEMA)
+    after = fq.generate_filter_sql("contracts effective after 2020", SCHEMA)
+
+    assert before == "effective_date < '2020-01-01'"
+    assert after == "effective_date > '2020-01-01'"
+    assert len(llm_calls) == 2
+
+
+def test_semantic_reuse_is_not_stored_as_exact_answer(llm_calls):
+    first = fq.generate_filter_sql("contracts effective before 2020", SCHEMA)
+    reused = fq.generate_filter_sql("agreements effective before 2020", SCHEMA)
+
+    assert reused == first
+    assert len(llm_calls) == 1
+    schema_items = tuple(sorted(SCHEMA.items()))
+    assert fq._generate_where.peek("agreements effective before 2020", schema_items, fq.TABLE_NAME) is None
+
+
+def test_different_names_and_literals_do_not_share_sql(llm_calls):
+    fq.generate_filter_sql("contracts with Acme", SCHEMA)
+    fq.generate_filter_sql("contracts with Globex", SCHEMA)
+    fq.generate_filter_sql("contracts governed by 'New York' law", SCHEMA)
+    fq.generate_filter_sql("contracts governed by 'Delaware' law", SCHEMA)
+
+    assert len(llm_calls) == 4
+
+
+def test_semantic_cache_evicts_least_recently_used():
+    from embedding_cache import SemanticCache
+
+    cache = SemanticCache(lambda texts: [[1.0, 0.0] for _ in texts], max_entries=2)
+    vector = cache.embed("query")
+    cache.put(vector, "a", 1)
+    cache.put(vector, "b", 2)
+    assert cache.get(vector, "a") == 1  # "b" is now the least recently used
+    cache.put(vector, "c", 3)
+
+    assert len(cache) == 2
+    assert cache.get(vector, "b") is None
+    assert cache.get(vector, "a") == 1
+    assert cache.get(vector, "c") == 3